@@ -1,45 +1,45 @@
+import collections
 import uuid
-import redis
+
 import requests
-from apiflask import APIFlask, Schema
-from apiflask.fields import String, UUID
+from apiflask import APIFlask, HTTPError, abort
 from flask_cors import CORS
 
+from basket_store import BasketFull, BasketNotFound, BasketStore
+from basket_sweeper import BasketSweeper
+from basket_view import basket_item, bulk_add_results, expand_basket
+from item_catalog import ItemCatalog, create_session
+from redis_connection import create_redis_client
+from schemas import (
+    AddItemQuery, BasketExpandedOut, BasketIDOut, BasketItemOut, BasketLinesIn, BasketLinesOut, BasketQuantityIn,
+    BasketRemoveIn, BasketStatsOut, DecrementQuery
+)
+from settings import (
+    basket_sweep_interval, basket_ttl, item_sync_interval, items_batch_url, items_service_url, max_basket_lines
+)
+
 app = APIFlask(__name__)
 CORS(app)
 
-redis_client = redis.StrictRedis(host='redis', port=6379, db=0, decode_responses=True)
-
-items_service_url = 'http://items_service:5000/api/v1/items/'
-
-
-class BasketItemIn(Schema):
-    """
-    Basket Item Schema
-
-    :param item_uuid: Unique identifier for the item
-    """
-    item_uuid = String(required=True)
-
+redis_client = create_redis_client()
+basket_store = BasketStore(redis_client, basket_ttl, max_basket_lines)
+basket_store.load_scripts()
+basket_sweeper = BasketSweeper(redis_client, basket_ttl)
+basket_sweeper.start(basket_sweep_interval)
 
-class BasketItemOut(Schema):
-    """
-    Basket Item Schema for output endpoints
+items_session = create_session()
+item_catalog = ItemCatalog(redis_client, items_service_url, items_batch_url, items_session)
+item_catalog.start_sync(item_sync_interval)
 
-    :param item_uuid: Unique identifier for the item
-    :param url: URL of the item in the items_service
-    """
-    item_uuid = UUID()
-    item_url = String()
 
+@app.errorhandler(BasketNotFound)
+def basket_not_found(error):
+    return app.error_callback(HTTPError(404, "Basket not found"))
 
-class BasketIDOut(Schema):
-    """
-    Basket ID Schema
 
-    :param basket_id: Unique identifier for the basket
-    """
-    basket_id = String()
+@app.errorhandler(BasketFull)
+def basket_full(error):
+    return app.error_callback(HTTPError(409, f"A basket can hold at most {basket_store.max_lines} different items"))
 
 
 @app.post('/api/v1/basket')
@@ -51,70 +51,202 @@ def create_basket():
     :return: The basket ID
     """
     basket_id = str(uuid.uuid4())
-    redis_client.hset(basket_id, 'basket_id', basket_id)
+    basket_store.create(basket_id)
     return {"basket_id": basket_id}, 201
 
 
 @app.post('/api/v1/basket/<basket_id>/add_item')
-@app.input({'item_uuid': String()}, location='query', schema_name='StringQuery')
+@app.input(AddItemQuery, location='query')
 @app.output(BasketItemOut, status_code=201)
+@app.doc(responses=[201, 404, 409, 503])
 def add_item_to_basket(basket_id, item):
     """
     Add item to basket
-    :param item: Item data
+    :param item: Item data and the number of units to add
     :param basket_id: Unique identifier for the basket
-    :return: The item data that was added to the basket
+    :return: The item data that was added to the basket, with the quantity now in the basket
     """
     item_uuid = item['item_uuid']
-    item_url = items_service_url + str(item_uuid)
-    response = requests.get(item_url)
-    response.raise_for_status()
-    data = {'item_uuid': item_uuid, 'item_url': item_url}
-    redis_client.rpush(f'basket_items:{basket_id}', item_uuid)
-    return BasketItemOut().load(data), 201
+    try:
+        if not item_catalog.exists(item_uuid):
+            abort(404, "Item not found")
+    except requests.RequestException:
+        abort(503, "Could not reach the items service")
+    quantity = basket_store.add(basket_id, {item_uuid: item['quantity']})[item_uuid]
+    return BasketItemOut().load(basket_item(item_uuid, quantity)), 201
+
+
+@app.post('/api/v1/basket/<basket_id>/add_items')
+@app.input(BasketLinesIn)
+@app.output(BasketLinesOut)
+@app.doc(responses=[200, 404, 409, 503])
+def add_items_to_basket(basket_id, data):
+    """
+    Add several items to a basket at once
+
+    All items are validated with a single batched items_service lookup and written with a single Redis transaction.
+    :param basket_id: Unique identifier for the basket
+    :param data: Items and quantities to add
+    :return: Whether each line was accepted
+    """
+    lines = data['items']
+    try:
+        exists = item_catalog.exists_many([line['item_uuid'] for line in lines])
+    except requests.RequestException:
+        abort(503, "Could not reach the items service")
+    results, accepted = bulk_add_results(lines, exists)
+    if accepted:
+        basket_store.add(basket_id, accepted)
+    return {'results': results}
 
 
 @app.get('/api/v1/basket/<basket_id>')
 @app.output(BasketItemOut(many=True))
+@app.doc(responses=[200, 404])
 def get_basket(basket_id):
     """
     Get basket items
 
     :param basket_id: Unique identifier for the basket
-    :return: A list of items in the basket
+    :return: A list of items in the basket, one entry per item with its quantity
     """
-    basket_items = redis_client.lrange(f'basket_items:{basket_id}', 0, -1)
-    items = []
-    for item_uuid in basket_items:
-        item_url = items_service_url + str(item_uuid)
-        items.append({'item_uuid': item_uuid, 'item_url': item_url})
+    lines = basket_store.get_lines(basket_id)
+    items = [basket_item(item_uuid, quantity) for item_uuid, quantity in lines.items()]
     return BasketItemOut(many=True).load(items)
 
 
-@app.delete('/api/v1/basket/<basket_id>/remove_item/<item_id>')
+@app.get('/api/v1/basket/<basket_id>/expanded')
+@app.output(BasketExpandedOut)
+@app.doc(responses=[200, 404, 503])
+def get_expanded_basket(basket_id):
+    """
+    Get a basket with item details and totals
+
+    Every line carries the item's name, price and line total, and the basket total is included. All items are
+    resolved with one batched items_service call, minus the ones whose details are still cached.
+    :param basket_id: Unique identifier for the basket
+    :return: The lines of the basket with item details, the items that no longer exist and the basket total
+    """
+    lines = basket_store.get_lines(basket_id)
+    try:
+        details = item_catalog.get_many(list(lines))
+    except requests.RequestException:
+        abort(503, "Could not reach the items service")
+    return expand_basket(basket_id, lines, details)
+
+
+@app.put('/api/v1/basket/<basket_id>/items/<uuid:item_id>')
+@app.input(BasketQuantityIn)
+@app.output(BasketItemOut)
+@app.doc(responses=[200, 404, 409, 503])
+def set_item_quantity(basket_id, item_id, data):
+    """
+    Set the quantity of an item in the basket
+
+    :param basket_id: Unique identifier for the basket
+    :param item_id: Unique identifier for the item
+    :param data: New quantity, 0 removes the item
+    :return: The item data with its new quantity
+    """
+    item_id = str(item_id)
+    if data['quantity'] > 0:
+        try:
+            if not item_catalog.exists(item_id):
+                abort(404, "Item not found")
+        except requests.RequestException:
+            abort(503, "Could not reach the items service")
+    basket_store.set_quantity(basket_id, item_id, data['quantity'])
+    return BasketItemOut().load(basket_item(item_id, data['quantity']))
+
+
+@app.post('/api/v1/basket/<basket_id>/items/<uuid:item_id>/decrement')
+@app.input(DecrementQuery, location='query')
+@app.output(BasketItemOut)
+@app.doc(responses=[200, 404])
+def decrement_item_quantity(basket_id, item_id, query):
+    """
+    Remove units of an item from the basket, removing the item once none are left
+
+    :param basket_id: Unique identifier for the basket
+    :param item_id: Unique identifier for the item
+    :param query: Number of units to remove
+    :return: The item data with the quantity left in the basket
+    """
+    item_id = str(item_id)
+    quantity = basket_store.decrement(basket_id, item_id, query['quantity'])
+    return BasketItemOut().load(basket_item(item_id, quantity))
+
+
+@app.post('/api/v1/basket/<basket_id>/remove_items')
+@app.input(BasketRemoveIn)
+@app.doc(responses=[204, 404])
+def remove_items_from_basket(basket_id, data):
+    """
+    Remove units of several items at once, e.g. those of an order checked out from the basket. Lines added meanwhile
+    are kept
+
+    :param basket_id: Unique identifier for the basket
+    :param data: Items and quantities to remove, and the checkout they belong to
+    :return: Nothing
+    """
+    quantities = collections.Counter()
+    for line in data['items']:
+        quantities[line['item_uuid']] += line['quantity']
+    basket_store.remove(basket_id, quantities, data.get('checkout_id'))
+    return '', 204
+
+
+@app.delete('/api/v1/basket/<basket_id>/remove_item/<uuid:item_id>')
+@app.doc(responses=[204, 404])
 def remove_item_from_basket(basket_id, item_id):
     """
-    Remove item from basket
+    Remove one unit of an item from the basket
 
     :param basket_id: Unique identifier for the basket
     :param item_id: Unique identifier for the item
     :return: Nothing
     """
-    redis_client.lrem(f'basket_items:{basket_id}', 1, item_id)
+    basket_store.decrement(basket_id, str(item_id))
+    return '', 204
+
+
+@app.delete('/api/v1/basket/<basket_id>/items')
+@app.doc(responses=[204, 404])
+def clear_basket(basket_id):
+    """
+    Remove all items from the basket, keeping the basket
+
+    :param basket_id: Unique identifier for the basket
+    :return: Nothing
+    """
+    basket_store.clear(basket_id)
     return '', 204
 
 
 @app.delete('/api/v1/basket/<basket_id>')
 def delete_basket(basket_id):
     """
-    Empty basket
+    Delete basket
 
     :param basket_id: Unique identifier for the basket
     :return: Nothing
     """
-    redis_client.delete(f'basket_items:{basket_id}')
+    basket_store.delete(basket_id)
     return '', 204
 
 
+@app.get('/api/v1/basket/admin/stats')
+@app.output(BasketStatsOut)
+def get_basket_stats():
+    """
+    Get basket key statistics
+
+    Basket counts and key memory are those found by the last sweep, which also reports how many orphaned keys it
+    deleted and how many keys it gave an expiry.
+    :return: Basket stats and the reports of the last sweeps
+    """
+    return basket_sweeper.stats()
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001, host='0.0.0.0')
@@ -0,0 +1,230 @@
+"""
+asyncio version of the basket API
+
+Serves the same endpoints, schemas and error bodies as app.py, but every request runs on one event loop with
+redis.asyncio and httpx, so a waiting Redis or items_service call does not hold a thread. Run with:
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5001
+
+The known_items set is still synced by ItemCatalog's background thread and basket keys are swept by BasketSweeper's,
+both started with the app on their own synchronous Redis client.
+"""
+import collections
+import contextlib
+import uuid
+
+import httpx
+from marshmallow import ValidationError
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from basket_store import AsyncBasketStore, BasketFull, BasketNotFound
+from basket_sweeper import BasketSweeper
+from basket_view import basket_item, bulk_add_results, expand_basket
+from item_catalog import AsyncItemCatalog, ItemCatalog, create_http_client, create_session
+from redis_connection import create_async_redis_client, create_redis_client
+from schemas import (
+    AddItemQuery, BasketExpandedOut, BasketIDOut, BasketItemOut, BasketLinesIn, BasketLinesOut, BasketQuantityIn,
+    BasketRemoveIn, BasketStatsOut, DecrementQuery
+)
+from settings import (
+    basket_sweep_interval, basket_ttl, item_sync_interval, items_batch_url, items_service_url, max_basket_lines
+)
+
+redis_client = create_async_redis_client()
+basket_store = AsyncBasketStore(redis_client, basket_ttl, max_basket_lines)
+
+http_client = create_http_client()
+item_catalog = AsyncItemCatalog(redis_client, items_service_url, items_batch_url, http_client)
+
+
+class APIError(Exception):
+    """
+    Error returned with the same body as APIFlask's abort
+
+    :param status_code: HTTP status code
+    :param message: Error message
+    :param detail: Error details, such as validation messages per field
+    """
+    def __init__(self, status_code, message, detail=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.detail = detail or {}
+
+
+async def api_error(request, error):
+    return JSONResponse({'detail': error.detail, 'message': error.message}, status_code=error.status_code)
+
+
+async def http_error(request, error):
+    return JSONResponse({'detail': {}, 'message': error.detail}, status_code=error.status_code)
+
+
+async def basket_not_found(request, error):
+    return await api_error(request, APIError(404, "Basket not found"))
+
+
+async def basket_full(request, error):
+    message = f"A basket can hold at most {basket_store.max_lines} different items"
+    return await api_error(request, APIError(409, message))
+
+
+async def load(schema, request, location):
+    """
+    Validate the query string or JSON body of a request
+
+    :param schema: Schema instance to load the data with
+    :param request: The request
+    :param location: 'query' or 'json'
+    :return: The loaded data
+    """
+    if location == 'query':
+        data = dict(request.query_params)
+    else:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+    try:
+        return schema.load(data)
+    except ValidationError as e:
+        raise APIError(422, 'Validation error', {location: e.messages})
+
+
+async def create_basket(request):
+    basket_id = str(uuid.uuid4())
+    await basket_store.create(basket_id)
+    return JSONResponse(BasketIDOut().dump({'basket_id': basket_id}), status_code=201)
+
+
+async def add_item_to_basket(request):
+    basket_id = request.path_params['basket_id']
+    item = await load(AddItemQuery(), request, 'query')
+    item_uuid = item['item_uuid']
+    try:
+        if not await item_catalog.exists(item_uuid):
+            raise APIError(404, "Item not found")
+    except httpx.HTTPError:
+        raise APIError(503, "Could not reach the items service")
+    quantity = (await basket_store.add(basket_id, {item_uuid: item['quantity']}))[item_uuid]
+    return JSONResponse(BasketItemOut().dump(basket_item(item_uuid, quantity)), status_code=201)
+
+
+async def add_items_to_basket(request):
+    basket_id = request.path_params['basket_id']
+    lines = (await load(BasketLinesIn(), request, 'json'))['items']
+    try:
+        exists = await item_catalog.exists_many([line['item_uuid'] for line in lines])
+    except httpx.HTTPError:
+        raise APIError(503, "Could not reach the items service")
+    results, accepted = bulk_add_results(lines, exists)
+    if accepted:
+        await basket_store.add(basket_id, accepted)
+    return JSONResponse(BasketLinesOut().dump({'results': results}))
+
+
+async def get_basket(request):
+    lines = await basket_store.get_lines(request.path_params['basket_id'])
+    items = [basket_item(item_uuid, quantity) for item_uuid, quantity in lines.items()]
+    return JSONResponse(BasketItemOut(many=True).dump(items))
+
+
+async def get_expanded_basket(request):
+    basket_id = request.path_params['basket_id']
+    lines = await basket_store.get_lines(basket_id)
+    try:
+        details = await item_catalog.get_many(list(lines))
+    except httpx.HTTPError:
+        raise APIError(503, "Could not reach the items service")
+    return JSONResponse(BasketExpandedOut().dump(expand_basket(basket_id, lines, details)))
+
+
+async def set_item_quantity(request):
+    basket_id, item_id = request.path_params['basket_id'], str(request.path_params['item_id'])
+    data = await load(BasketQuantityIn(), request, 'json')
+    if data['quantity'] > 0:
+        try:
+            if not await item_catalog.exists(item_id):
+                raise APIError(404, "Item not found")
+        except httpx.HTTPError:
+            raise APIError(503, "Could not reach the items service")
+    await basket_store.set_quantity(basket_id, item_id, data['quantity'])
+    return JSONResponse(BasketItemOut().dump(basket_item(item_id, data['quantity'])))
+
+
+async def decrement_item_quantity(request):
+    basket_id, item_id = request.path_params['basket_id'], str(request.path_params['item_id'])
+    query = await load(DecrementQuery(), request, 'query')
+    quantity = await basket_store.decrement(basket_id, item_id, query['quantity'])
+    return JSONResponse(BasketItemOut().dump(basket_item(item_id, quantity)))
+
+
+async def remove_items_from_basket(request):
+    data = await load(BasketRemoveIn(), request, 'json')
+    quantities = collections.Counter()
+    for line in data['items']:
+        quantities[line['item_uuid']] += line['quantity']
+    await basket_store.remove(request.path_params['basket_id'], quantities, data.get('checkout_id'))
+    return Response(status_code=204)
+
+
+async def remove_item_from_basket(request):
+    await basket_store.decrement(request.path_params['basket_id'], str(request.path_params['item_id']))
+    return Response(status_code=204)
+
+
+async def clear_basket(request):
+    await basket_store.clear(request.path_params['basket_id'])
+    return Response(status_code=204)
+
+
+async def delete_basket(request):
+    await basket_store.delete(request.path_params['basket_id'])
+    return Response(status_code=204)
+
+
+async def get_basket_stats(request):
+    stats = await run_in_threadpool(request.app.state.basket_sweeper.stats)
+    return JSONResponse(BasketStatsOut().dump(stats))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await basket_store.load_scripts()
+    sync_redis_client = create_redis_client()
+    ItemCatalog(sync_redis_client, items_service_url, items_batch_url, create_session()).start_sync(item_sync_interval)
+    app.state.basket_sweeper = BasketSweeper(sync_redis_client, basket_ttl)
+    app.state.basket_sweeper.start(basket_sweep_interval)
+    yield
+    await http_client.aclose()
+    await redis_client.close()
+    sync_redis_client.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/v1/basket', create_basket, methods=['POST']),
+        Route('/api/v1/basket/admin/stats', get_basket_stats, methods=['GET']),
+        Route('/api/v1/basket/{basket_id}/add_item', add_item_to_basket, methods=['POST']),
+        Route('/api/v1/basket/{basket_id}/add_items', add_items_to_basket, methods=['POST']),
+        Route('/api/v1/basket/{basket_id}', get_basket, methods=['GET']),
+        Route('/api/v1/basket/{basket_id}/expanded', get_expanded_basket, methods=['GET']),
+        Route('/api/v1/basket/{basket_id}', delete_basket, methods=['DELETE']),
+        Route('/api/v1/basket/{basket_id}/items', clear_basket, methods=['DELETE']),
+        Route('/api/v1/basket/{basket_id}/items/{item_id:uuid}', set_item_quantity, methods=['PUT']),
+        Route('/api/v1/basket/{basket_id}/items/{item_id:uuid}/decrement', decrement_item_quantity, methods=['POST']),
+        Route('/api/v1/basket/{basket_id}/remove_items', remove_items_from_basket, methods=['POST']),
+        Route('/api/v1/basket/{basket_id}/remove_item/{item_id:uuid}', remove_item_from_basket, methods=['DELETE']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    exception_handlers={
+        APIError: api_error, HTTPException: http_error, BasketNotFound: basket_not_found, BasketFull: basket_full
+    },
+    lifespan=lifespan
+)
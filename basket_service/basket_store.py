@@ -0,0 +1,331 @@
+"""
+Redis storage of baskets
+
+A basket is a hash basket:{<basket_id>} holding the basket's own fields and a hash basket_lines:{<basket_id>}
+mapping each item_uuid to its quantity, so adding, removing and changing the quantity of a line are O(1) whatever the
+size of the basket. Both keys carry the {basket_id} hash tag, so they are on the same Redis Cluster slot.
+
+Every operation on a basket is a Lua script run with EVALSHA, so it is atomic and takes a single round trip. Each
+script checks that the basket exists, does its work and refreshes the expiry of both keys, so only abandoned baskets
+expire. Writes that would take a basket over max_lines lines are refused. The units of a checkout are removed with
+its id, which is recorded in the basket hash so that a retried checkout does not remove them twice.
+
+Keys written before the hash tags, and baskets from when every unit was a list entry, are converted by
+migrate_keys.py.
+
+BasketStore is used by the Flask app and AsyncBasketStore, which runs the same scripts, by the ASGI app.
+"""
+import logging
+
+import redis
+
+# Baskets expire after a week without access
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_LINES = 1000
+# Returned by the scripts when a write would take the basket over its line cap
+FULL = -1
+
+# KEYS: basket hash, lines hash. ARGV[1]: TTL. A missing basket returns nil
+PRELUDE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local result
+"""
+
+TOUCH = """
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return result
+"""
+
+# ARGV: TTL, basket_id
+CREATE = """
+redis.call('HSET', KEYS[1], 'basket_id', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# ARGV: TTL, max lines, then item_uuid and quantity pairs. Returns the new quantities in ARGV order
+ADD = PRELUDE + """
+local new_lines = 0
+for i = 3, #ARGV, 2 do
+    new_lines = new_lines + 1 - redis.call('HEXISTS', KEYS[2], ARGV[i])
+end
+if new_lines > 0 and redis.call('HLEN', KEYS[2]) + new_lines > tonumber(ARGV[2]) then
+    result = -1
+else
+    result = {}
+    for i = 3, #ARGV, 2 do
+        result[#result + 1] = redis.call('HINCRBY', KEYS[2], ARGV[i], ARGV[i + 1])
+    end
+end
+""" + TOUCH
+
+# ARGV: TTL, max lines, item_uuid, quantity. A quantity of 0 removes the line
+SET_QUANTITY = PRELUDE + """
+result = 1
+if tonumber(ARGV[4]) > 0 then
+    if redis.call('HEXISTS', KEYS[2], ARGV[3]) == 0 and redis.call('HLEN', KEYS[2]) >= tonumber(ARGV[2]) then
+        result = -1
+    else
+        redis.call('HSET', KEYS[2], ARGV[3], ARGV[4])
+    end
+else
+    redis.call('HDEL', KEYS[2], ARGV[3])
+end
+""" + TOUCH
+
+# ARGV: TTL, item_uuid, quantity. Returns the quantity left
+DECREMENT = PRELUDE + """
+result = math.max((tonumber(redis.call('HGET', KEYS[2], ARGV[2])) or 0) - tonumber(ARGV[3]), 0)
+if result > 0 then
+    redis.call('HSET', KEYS[2], ARGV[2], result)
+else
+    redis.call('HDEL', KEYS[2], ARGV[2])
+end
+""" + TOUCH
+
+# ARGV: TTL, checkout id or an empty string, then item_uuid and quantity pairs. A checkout id is recorded in the
+# basket hash, and the units of a checkout that is already recorded are not removed again
+REMOVE = PRELUDE + """
+result = 1
+if ARGV[2] == '' or redis.call('HSETNX', KEYS[1], 'checkout:' .. ARGV[2], 1) == 1 then
+    for i = 3, #ARGV, 2 do
+        local left = (tonumber(redis.call('HGET', KEYS[2], ARGV[i])) or 0) - tonumber(ARGV[i + 1])
+        if left > 0 then
+            redis.call('HSET', KEYS[2], ARGV[i], left)
+        else
+            redis.call('HDEL', KEYS[2], ARGV[i])
+        end
+    end
+end
+""" + TOUCH
+
+# ARGV: TTL
+CLEAR = PRELUDE + """
+redis.call('DEL', KEYS[2])
+result = 1
+""" + TOUCH
+
+# ARGV: TTL. Returns the lines as a flat list of item_uuid and quantity
+GET_LINES = PRELUDE + """
+result = redis.call('HGETALL', KEYS[2])
+""" + TOUCH
+
+SCRIPTS = {
+    'create': CREATE,
+    'add': ADD,
+    'set_quantity': SET_QUANTITY,
+    'decrement': DECREMENT,
+    'remove': REMOVE,
+    'clear': CLEAR,
+    'get_lines': GET_LINES
+}
+
+logger = logging.getLogger(__name__)
+
+
+class BasketNotFound(Exception):
+    pass
+
+
+class BasketFull(Exception):
+    pass
+
+
+def basket_key(basket_id):
+    return f'basket:{{{basket_id}}}'
+
+
+def lines_key(basket_id):
+    return f'basket_lines:{{{basket_id}}}'
+
+
+def basket_keys(basket_id):
+    """
+    :param basket_id: Unique identifier for the basket
+    :return: The keys every script is called with
+    """
+    return [basket_key(basket_id), lines_key(basket_id)]
+
+
+def checked(result):
+    """
+    :param result: Result of a script
+    :return: The result, unless it says the basket is missing or full
+    """
+    if result is None:
+        raise BasketNotFound()
+    if result == FULL:
+        raise BasketFull()
+    return result
+
+
+def to_lines(flat):
+    """
+    :param flat: Flat list of item_uuid and quantity, as returned by HGETALL inside a script
+    :return: Dictionary of item_uuid to quantity
+    """
+    return {flat[i]: int(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+
+class BasketStore:
+    """
+    Basket operations on top of a Redis client created with decode_responses=True
+
+    Operations on a basket that does not exist raise BasketNotFound, and writes that would take a basket over
+    max_lines lines raise BasketFull.
+    :param redis_client: Redis client
+    :param ttl: Seconds without access after which a basket expires
+    :param max_lines: Maximum number of lines of a basket
+    """
+    def __init__(self, redis_client, ttl=DEFAULT_TTL, max_lines=DEFAULT_MAX_LINES):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_lines = max_lines
+        self.scripts = {name: redis_client.register_script(source) for name, source in SCRIPTS.items()}
+
+    def load_scripts(self):
+        """
+        Load the scripts into Redis so that the first call of each does not need a retry. Scripts that are not
+        loaded are loaded by their first call
+        """
+        try:
+            for script in self.scripts.values():
+                self.redis_client.script_load(script.script)
+        except redis.RedisError:
+            logger.exception("Could not preload the basket scripts")
+
+    def _run(self, name, basket_id, *args):
+        return checked(self.scripts[name](keys=basket_keys(basket_id), args=[self.ttl, *args]))
+
+    def create(self, basket_id):
+        """
+        Create an empty basket
+
+        :param basket_id: Unique identifier for the basket
+        """
+        self._run('create', basket_id, basket_id)
+
+    def add(self, basket_id, quantities):
+        """
+        Add units of one or more items
+
+        :param basket_id: Unique identifier for the basket
+        :param quantities: Dictionary of item_uuid to the number of units to add
+        :return: Dictionary of item_uuid to the quantity now in the basket
+        """
+        items = list(quantities)
+        args = [value for item_uuid in items for value in (item_uuid, quantities[item_uuid])]
+        return dict(zip(items, self._run('add', basket_id, self.max_lines, *args)))
+
+    def set_quantity(self, basket_id, item_uuid, quantity):
+        """
+        Set the quantity of a line, removing it if the quantity is 0
+
+        :param basket_id: Unique identifier for the basket
+        :param item_uuid: Unique identifier for the item
+        :param quantity: New quantity
+        """
+        self._run('set_quantity', basket_id, self.max_lines, item_uuid, quantity)
+
+    def decrement(self, basket_id, item_uuid, quantity=1):
+        """
+        Remove units of an item, removing the line once none are left
+
+        :param basket_id: Unique identifier for the basket
+        :param item_uuid: Unique identifier for the item
+        :param quantity: Number of units to remove
+        :return: The quantity left in the basket
+        """
+        return self._run('decrement', basket_id, item_uuid, quantity)
+
+    def remove(self, basket_id, quantities, checkout_id=None):
+        """
+        Remove units of one or more items, removing the lines none are left of
+
+        :param basket_id: Unique identifier for the basket
+        :param quantities: Dictionary of item_uuid to the number of units to remove
+        :param checkout_id: Order the units were checked out into. Units are removed once per checkout_id, later
+            calls with the same one do nothing
+        """
+        args = [value for item_uuid, quantity in quantities.items() for value in (item_uuid, quantity)]
+        self._run('remove', basket_id, checkout_id or '', *args)
+
+    def get_lines(self, basket_id):
+        """
+        Get all lines of a basket
+
+        :param basket_id: Unique identifier for the basket
+        :return: Dictionary of item_uuid to quantity
+        """
+        return to_lines(self._run('get_lines', basket_id))
+
+    def clear(self, basket_id):
+        """
+        Remove all lines of a basket, keeping the basket
+
+        :param basket_id: Unique identifier for the basket
+        """
+        self._run('clear', basket_id)
+
+    def delete(self, basket_id):
+        """
+        Delete a basket and all of its lines
+
+        :param basket_id: Unique identifier for the basket
+        """
+        self.redis_client.delete(*basket_keys(basket_id))
+
+
+class AsyncBasketStore:
+    """
+    asyncio version of BasketStore, on top of a redis.asyncio client created with decode_responses=True
+
+    :param redis_client: redis.asyncio client
+    :param ttl: Seconds without access after which a basket expires
+    :param max_lines: Maximum number of lines of a basket
+    """
+    def __init__(self, redis_client, ttl=DEFAULT_TTL, max_lines=DEFAULT_MAX_LINES):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_lines = max_lines
+        self.scripts = {name: redis_client.register_script(source) for name, source in SCRIPTS.items()}
+
+    async def load_scripts(self):
+        try:
+            for script in self.scripts.values():
+                await self.redis_client.script_load(script.script)
+        except redis.RedisError:
+            logger.exception("Could not preload the basket scripts")
+
+    async def _run(self, name, basket_id, *args):
+        return checked(await self.scripts[name](keys=basket_keys(basket_id), args=[self.ttl, *args]))
+
+    async def create(self, basket_id):
+        await self._run('create', basket_id, basket_id)
+
+    async def add(self, basket_id, quantities):
+        items = list(quantities)
+        args = [value for item_uuid in items for value in (item_uuid, quantities[item_uuid])]
+        return dict(zip(items, await self._run('add', basket_id, self.max_lines, *args)))
+
+    async def set_quantity(self, basket_id, item_uuid, quantity):
+        await self._run('set_quantity', basket_id, self.max_lines, item_uuid, quantity)
+
+    async def decrement(self, basket_id, item_uuid, quantity=1):
+        return await self._run('decrement', basket_id, item_uuid, quantity)
+
+    async def remove(self, basket_id, quantities, checkout_id=None):
+        args = [value for item_uuid, quantity in quantities.items() for value in (item_uuid, quantity)]
+        await self._run('remove', basket_id, checkout_id or '', *args)
+
+    async def get_lines(self, basket_id):
+        return to_lines(await self._run('get_lines', basket_id))
+
+    async def clear(self, basket_id):
+        await self._run('clear', basket_id)
+
+    async def delete(self, basket_id):
+        await self.redis_client.delete(*basket_keys(basket_id))
@@ -0,0 +1,159 @@
+"""
+Background sweeping of basket keys
+
+The sweeper walks the keyspace with SCAN in small batches, so Redis is never blocked for long, and for every basket
+key it finds:
+
+- deletes lines keys whose basket hash is gone, e.g. because it expired or was deleted while the lines were written,
+- gives keys without an expiry, such as keys restored by migrate_keys.py, the basket TTL,
+- adds up the memory used by basket keys.
+
+Expired keys are removed by Redis itself. The sweep reports what it reclaimed and the last reports are kept in Redis,
+so the admin stats endpoint of every replica can show them. Only one replica sweeps at a time. In cluster mode every
+primary node is scanned.
+"""
+import datetime
+import json
+import logging
+import re
+import threading
+import time
+
+import redis
+
+from basket_store import basket_key
+from redis_lock import RedisLock
+
+BASKET_KEY_PATTERN = re.compile(r'(basket|basket_lines):\{(.+)\}')
+LOCK_KEY = 'basket_sweep:lock'
+HISTORY_KEY = 'basket_sweep:history'
+HISTORY_SIZE = 20
+
+logger = logging.getLogger(__name__)
+
+
+def basket_id_of(key):
+    """
+    :param key: Redis key
+    :return: The basket ID the key belongs to, or None if it is not a basket key
+    """
+    match = BASKET_KEY_PATTERN.fullmatch(key)
+    return match.group(2) if match else None
+
+
+class BasketSweeper:
+    """
+    Reclaims orphaned basket keys and gives keys without an expiry the basket TTL
+
+    :param redis_client: Redis client created with decode_responses=True
+    :param ttl: Seconds without access after which a basket expires
+    :param batch_size: Number of keys asked for per SCAN call
+    :param lock_seconds: How long a sweep may hold the lock before another replica may start one
+    """
+    def __init__(self, redis_client, ttl, batch_size=500, lock_seconds=600):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.lock_seconds = lock_seconds
+
+    def _sweep_batch(self, keys, report):
+        """
+        Sweep the basket keys of one SCAN batch
+
+        :param keys: Keys returned by SCAN
+        :param report: Sweep report to be updated
+        """
+        keys = [(key, basket_id_of(key)) for key in keys]
+        keys = [(key, basket_id) for key, basket_id in keys if basket_id is not None]
+        if not keys:
+            return
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for key, basket_id in keys:
+            pipeline.ttl(key)
+            pipeline.exists(basket_key(basket_id))
+            pipeline.memory_usage(key)
+        results = pipeline.execute()
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for index, (key, basket_id) in enumerate(keys):
+            ttl, basket_exists, memory = results[3 * index:3 * index + 3]
+            if ttl == -2:
+                # Expired or deleted since SCAN returned it
+                continue
+            is_basket = key == basket_key(basket_id)
+            if not is_basket and not basket_exists:
+                pipeline.unlink(key)
+                report['orphans_deleted'] += 1
+                continue
+            if ttl == -1:
+                pipeline.expire(key, self.ttl)
+                report['expiry_set'] += 1
+            if is_basket:
+                report['baskets'] += 1
+            report['keys'] += 1
+            report['key_memory_bytes'] += memory or 0
+        pipeline.execute()
+
+    def sweep(self):
+        """
+        Sweep the whole keyspace once. Only one replica sweeps at a time
+
+        :return: The sweep report, or None if another replica is sweeping
+        """
+        lock = RedisLock(self.redis_client, LOCK_KEY, self.lock_seconds)
+        if not lock.acquire():
+            return None
+        try:
+            report = {
+                'started_at': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+                'baskets': 0, 'keys': 0, 'key_memory_bytes': 0, 'orphans_deleted': 0, 'expiry_set': 0
+            }
+            started = time.perf_counter()
+            batch = []
+            for key in self.redis_client.scan_iter(count=self.batch_size):
+                batch.append(key)
+                if len(batch) == self.batch_size:
+                    self._sweep_batch(batch, report)
+                    batch = []
+            self._sweep_batch(batch, report)
+            report['seconds'] = round(time.perf_counter() - started, 3)
+            pipeline = self.redis_client.pipeline()
+            pipeline.lpush(HISTORY_KEY, json.dumps(report))
+            pipeline.ltrim(HISTORY_KEY, 0, HISTORY_SIZE - 1)
+            pipeline.execute()
+            return report
+        finally:
+            lock.release()
+
+    def stats(self):
+        """
+        :return: Basket count and key memory of the last sweep, Redis memory use and the reports of the last sweeps
+        """
+        sweeps = [json.loads(report) for report in self.redis_client.lrange(HISTORY_KEY, 0, -1)]
+        last = sweeps[0] if sweeps else {}
+        memory = self.redis_client.info('memory')
+        if 'used_memory' not in memory:
+            # A cluster answers per node
+            memory = {'used_memory': sum(node['used_memory'] for node in memory.values())}
+        return {
+            'baskets': last.get('baskets'),
+            'key_memory_bytes': last.get('key_memory_bytes'),
+            'used_memory_bytes': memory['used_memory'],
+            'ttl_seconds': self.ttl,
+            'sweeps': sweeps
+        }
+
+    def start(self, interval):
+        """
+        Sweep from a daemon thread
+
+        :param interval: Seconds between sweeps
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except redis.RedisError:
+                    logger.exception("Could not sweep the basket keys")
+
+        threading.Thread(target=run, name='basket-sweeper', daemon=True).start()
@@ -0,0 +1,67 @@
+"""
+Response building shared by the Flask app (app.py) and the ASGI app (asgi_app.py)
+"""
+from collections import Counter
+
+from settings import items_service_url
+
+
+def basket_item(item_uuid, quantity):
+    """
+    :param item_uuid: Unique identifier for the item
+    :param quantity: Number of units of the item in the basket
+    :return: Basket item data with the URL of the item in the items_service
+    """
+    return {'item_uuid': item_uuid, 'item_url': items_service_url + str(item_uuid), 'quantity': quantity}
+
+
+def bulk_add_results(lines, exists):
+    """
+    Decide which lines of a bulk add are accepted
+
+    :param lines: Requested lines, each with an item_uuid and a quantity
+    :param exists: Dictionary of item_uuid to whether the item exists
+    :return: Result of every line in request order, and the quantities to add per item_uuid
+    """
+    accepted = Counter()
+    results = []
+    for line in lines:
+        result = {'item_uuid': line['item_uuid'], 'quantity': line['quantity']}
+        if exists[line['item_uuid']]:
+            accepted[line['item_uuid']] += line['quantity']
+            result['status'] = 'accepted'
+        else:
+            result.update(status='rejected', reason='Item not found')
+        results.append(result)
+    return results, accepted
+
+
+def expand_basket(basket_id, lines, details):
+    """
+    Add item details, line totals and the basket total to the lines of a basket
+
+    :param basket_id: Unique identifier for the basket
+    :param lines: Dictionary of item_uuid to quantity
+    :param details: Dictionary of item_uuid to item, for the items that exist
+    :return: The expanded basket
+    """
+    items = []
+    total = 0
+    for item_uuid, quantity in lines.items():
+        item = details.get(item_uuid)
+        if item is None:
+            continue
+        line_total = round(item['item_price'] * quantity, 2)
+        total += line_total
+        items.append({
+            **basket_item(item_uuid, quantity),
+            'item_name': item['item_name'],
+            'item_price': item['item_price'],
+            'line_total': line_total
+        })
+    return {
+        'basket_id': basket_id,
+        'items': items,
+        'missing': [item_uuid for item_uuid in lines if item_uuid not in details],
+        'total': round(total, 2)
+    }
@@ -0,0 +1,153 @@
+"""
+Benchmark of the basket mutations: Lua scripts against client-side checks
+
+scripts: BasketStore, where every operation is one EVALSHA that checks the basket, enforces the line cap, mutates
+and refreshes the expiry.
+pipeline: the same checks done from the client: one round trip to check the basket and its line count, one pipeline
+for the write and the expiry refresh, and a WATCH transaction for decrements.
+
+Each operation is run against a real Redis and the round trips are counted on the connection.
+
+Run with: python bench_basket_store.py --host localhost
+"""
+import argparse
+import statistics
+import time
+import uuid
+
+import redis
+
+from basket_store import BasketFull, BasketNotFound, BasketStore, basket_key, lines_key
+
+ITERATIONS = 2000
+
+
+class CountingConnection(redis.Connection):
+    """
+    Connection counting the packets sent to Redis, one per round trip
+    """
+    round_trips = 0
+
+    def send_packed_command(self, command, check_health=True):
+        CountingConnection.round_trips += 1
+        super().send_packed_command(command, check_health)
+
+
+class PipelineBasketStore(BasketStore):
+    """
+    Basket operations with the existence check and line cap done from the client
+    """
+    def _check(self, basket_id, item_uuids=()):
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.exists(basket_key(basket_id))
+        pipeline.hlen(lines_key(basket_id))
+        for item_uuid in item_uuids:
+            pipeline.hexists(lines_key(basket_id), item_uuid)
+        exists, line_count, *present = pipeline.execute()
+        if not exists:
+            raise BasketNotFound()
+        if line_count + present.count(False) > self.max_lines:
+            raise BasketFull()
+
+    def _write(self, basket_id, queue):
+        pipeline = self.redis_client.pipeline()
+        queue(pipeline)
+        pipeline.expire(basket_key(basket_id), self.ttl)
+        pipeline.expire(lines_key(basket_id), self.ttl)
+        return pipeline.execute()[:-2]
+
+    def add(self, basket_id, quantities):
+        self._check(basket_id, quantities)
+        return dict(zip(quantities, self._write(basket_id, lambda pipeline: [
+            pipeline.hincrby(lines_key(basket_id), item_uuid, quantity) for item_uuid, quantity in quantities.items()
+        ])))
+
+    def set_quantity(self, basket_id, item_uuid, quantity):
+        self._check(basket_id, [item_uuid])
+        self._write(basket_id, lambda pipeline: pipeline.hset(lines_key(basket_id), item_uuid, quantity))
+
+    def decrement(self, basket_id, item_uuid, quantity=1):
+        self._check(basket_id)
+        key = lines_key(basket_id)
+        left = 0
+
+        def remove(pipeline):
+            nonlocal left
+            left = max(int(pipeline.hget(key, item_uuid) or 0) - quantity, 0)
+            pipeline.multi()
+            if left:
+                pipeline.hset(key, item_uuid, left)
+            else:
+                pipeline.hdel(key, item_uuid)
+            pipeline.expire(basket_key(basket_id), self.ttl)
+            pipeline.expire(key, self.ttl)
+
+        self.redis_client.transaction(remove, key)
+        return left
+
+    def get_lines(self, basket_id):
+        self._check(basket_id)
+        return self._write(basket_id, lambda pipeline: pipeline.hgetall(lines_key(basket_id)))[0]
+
+    def clear(self, basket_id):
+        self._check(basket_id)
+        self._write(basket_id, lambda pipeline: pipeline.delete(lines_key(basket_id)))
+
+
+def run(store, iterations):
+    """
+    Run every operation iterations times on one basket
+
+    :return: Dictionary of operation name to round trips per call, mean and p99 latency in microseconds
+    """
+    basket_id = str(uuid.uuid4())
+    store.create(basket_id)
+    operations = {
+        'add': lambda: store.add(basket_id, {'item': 2}),
+        'set_quantity': lambda: store.set_quantity(basket_id, 'item', 3),
+        'decrement': lambda: store.decrement(basket_id, 'item'),
+        'get_lines': lambda: store.get_lines(basket_id),
+        'clear': lambda: store.clear(basket_id)
+    }
+    results = {}
+    for name, operation in operations.items():
+        operation()
+        latencies = []
+        round_trips = CountingConnection.round_trips
+        for _ in range(iterations):
+            started = time.perf_counter()
+            operation()
+            latencies.append(time.perf_counter() - started)
+        round_trips = (CountingConnection.round_trips - round_trips) / iterations
+        percentiles = statistics.quantiles(latencies, n=100)
+        results[name] = round_trips, statistics.mean(latencies) * 1e6, percentiles[98] * 1e6
+    store.delete(basket_id)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the basket scripts with client-side checks')
+    parser.add_argument('--host', default='redis', help='Redis host')
+    parser.add_argument('--port', type=int, default=6379, help='Redis port')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help='calls per operation')
+    args = parser.parse_args()
+
+    pool = redis.ConnectionPool(host=args.host, port=args.port, decode_responses=True,
+                                connection_class=CountingConnection)
+    redis_client = redis.StrictRedis(connection_pool=pool)
+    scripts = BasketStore(redis_client)
+    scripts.load_scripts()
+    results = {
+        'scripts': run(scripts, args.iterations),
+        'pipeline': run(PipelineBasketStore(redis_client), args.iterations)
+    }
+
+    print(f"{'operation':<14}{'store':<10}{'round trips':>12}{'mean us':>10}{'p99 us':>10}")
+    for name in results['scripts']:
+        for store in ('pipeline', 'scripts'):
+            round_trips, mean, p99 = results[store][name]
+            print(f"{name:<14}{store:<10}{round_trips:>12.1f}{mean:>10.0f}{p99:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
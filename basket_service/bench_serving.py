@@ -0,0 +1,133 @@
+"""
+Load test of the basket read path under the Flask app and the ASGI app
+
+Creates a basket with a few items on each server, then keeps the given number of connections busy sending
+GET /api/v1/basket/<basket_id> for a fixed time and reports requests per second and p50/p99 latency.
+The load generator is a single asyncio process writing raw HTTP/1.1, so it is not the bottleneck itself.
+
+Raise the open file limit (ulimit -n) above the highest concurrency first.
+
+Run with: python bench_serving.py --sync-url http://localhost:5001 --async-url http://localhost:5002
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+CONCURRENCY = [100, 1000, 10000]
+
+
+def create_basket(base_url, item_uuids):
+    """
+    Create the basket that is read during the test
+
+    :param base_url: Base URL of the basket service
+    :param item_uuids: UUIDs of existing items to put in the basket
+    :return: The basket ID
+    """
+    request = urllib.request.Request(base_url + '/api/v1/basket', method='POST')
+    basket_id = json.load(urllib.request.urlopen(request))['basket_id']
+    for item_uuid in item_uuids:
+        request = urllib.request.Request(
+            f'{base_url}/api/v1/basket/{basket_id}/add_item?item_uuid={item_uuid}', method='POST'
+        )
+        urllib.request.urlopen(request).read()
+    return basket_id
+
+
+async def read_response(reader):
+    """
+    Read one HTTP/1.x response with a Content-Length
+
+    :return: The status code, and whether the server keeps the connection open
+    """
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    version, status = status_line.split()[:2]
+    keep_alive = headers.get('connection', 'keep-alive' if version == 'HTTP/1.1' else 'close') == 'keep-alive'
+    return int(status), keep_alive
+
+
+async def connection(host, port, request, deadline, latencies, errors):
+    """
+    Send requests one after the other until the deadline, on one connection as long as the server keeps it open
+
+    The time to reconnect after the server closed the connection is part of the next request's latency.
+    """
+    writer = None
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), deadline - started)
+            writer.write(request)
+            status, keep_alive = await asyncio.wait_for(read_response(reader), deadline - started)
+        except asyncio.TimeoutError:
+            break
+        except (OSError, asyncio.IncompleteReadError):
+            errors.append('connection')
+            if writer is None:
+                break
+            writer.close()
+            writer = None
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            errors.append(status)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(base_url, basket_id, concurrency, duration):
+    """
+    Keep concurrency connections busy for duration seconds
+
+    :return: Requests per second, p50 and p99 latency in milliseconds, and the number of errors
+    """
+    url = urlsplit(base_url)
+    request = (f'GET /api/v1/basket/{basket_id} HTTP/1.1\r\nHost: {url.netloc}\r\n'
+               f'Connection: keep-alive\r\n\r\n').encode()
+    latencies, errors = [], []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[
+        connection(url.hostname, url.port or 80, request, deadline, latencies, errors) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+    if len(latencies) < 2:
+        return 0.0, 0.0, 0.0, len(errors)
+    percentiles = statistics.quantiles(latencies, n=100)
+    return len(latencies) / elapsed, percentiles[49] * 1000, percentiles[98] * 1000, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the Flask and ASGI basket apps under concurrent load')
+    parser.add_argument('--sync-url', default='http://localhost:5001', help='base URL of the Flask app')
+    parser.add_argument('--async-url', default='http://localhost:5002', help='base URL of the ASGI app')
+    parser.add_argument('--item', action='append', default=[], help='UUID of an item to put in the basket')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--concurrency', type=int, action='append', help='number of connections, repeatable')
+    args = parser.parse_args()
+
+    print(f"{'server':<8}{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, base_url in [('sync', args.sync_url), ('async', args.async_url)]:
+        basket_id = create_basket(base_url, args.item)
+        for concurrency in args.concurrency or CONCURRENCY:
+            rps, p50, p99, errors = asyncio.run(run(base_url, basket_id, concurrency, args.duration))
+            print(f"{name:<8}{concurrency:>12}{rps:>10.0f}{p50:>10.1f}{p99:>10.1f}{errors:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+"""
+Item existence checks for basket writes
+
+Known item UUIDs are looked up in three places, cheapest first:
+
+1. an in-process TTL cache of UUIDs this replica has recently seen exist,
+2. the known_items set in Redis, which a sync thread fills from items_service's catalog export and keeps current
+   with its change feed, so it is shared by all replicas,
+3. items_service itself, through a pooled session with timeouts.
+
+Only positive answers are cached. A UUID missing from both caches is always checked with items_service, so items
+created since the last sync are still accepted.
+
+Item details (names and prices) for basket views are kept in a separate in-process cache with a shorter TTL, so a
+price change shows up in baskets within seconds. Details that are not cached are fetched with one batched lookup.
+
+ItemCatalog is used by the Flask app and AsyncItemCatalog by the ASGI app. They share the in-process caches of
+LocalItemCache. The known_items set is always synced by ItemCatalog's background thread.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+
+from redis_lock import RedisLock
+
+
+# The keys share a hash tag so the loaded set can be renamed over the live one in Redis Cluster
+KNOWN_ITEMS_KEY = '{known_items}'
+LOADING_KEY = '{known_items}:loading'
+VERSION_KEY = '{known_items}:version'
+LOCK_KEY = '{known_items}:lock'
+LOCK_SECONDS = 60
+# Maximum number of ids items_service looks up in one batched call
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(pool_size=32):
+    """
+    Create a requests session that keeps connections to items_service alive
+
+    :param pool_size: Maximum number of pooled connections
+    :return: The session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def create_http_client(pool_size=100, keepalive_size=20, timeout=(0.5, 2)):
+    """
+    Create an async HTTP client that keeps connections to items_service alive
+
+    :param pool_size: Maximum number of open connections
+    :param keepalive_size: Maximum number of idle connections kept open
+    :param timeout: (connect, read) timeout, in seconds
+    :return: The client
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=keepalive_size),
+        timeout=httpx.Timeout(timeout[1], connect=timeout[0])
+    )
+
+
+class LocalItemCache:
+    """
+    In-process caches of known item UUIDs and of item details
+
+    :param ttl: Seconds a known UUID is kept in process
+    :param max_size: Maximum number of UUIDs and of item details kept in process
+    :param details_ttl: Seconds the details of an item are kept in process
+    """
+    def __init__(self, ttl=60, max_size=100000, details_ttl=10):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.details_ttl = details_ttl
+        self._known = OrderedDict()
+        self._details = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, item_uuid):
+        """
+        Cache an item UUID that is known to exist
+
+        :param item_uuid: UUID of the item
+        """
+        with self._lock:
+            self._known[item_uuid] = time.monotonic() + self.ttl
+            self._known.move_to_end(item_uuid)
+            while len(self._known) > self.max_size:
+                self._known.popitem(last=False)
+
+    def _remember_details(self, item):
+        with self._lock:
+            self._details[item['item_uuid']] = (time.monotonic() + self.details_ttl, item)
+            self._details.move_to_end(item['item_uuid'])
+            while len(self._details) > self.max_size:
+                self._details.popitem(last=False)
+
+    def cached_details(self, item_uuids):
+        """
+        Get the cached details of several items
+
+        :param item_uuids: UUIDs of the items
+        :return: Dictionary of the cached items by item_uuid
+        """
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for item_uuid in item_uuids:
+                entry = self._details.get(item_uuid)
+                if entry is not None and entry[0] >= now:
+                    found[item_uuid] = entry[1]
+        return found
+
+    def _remember_found(self, items):
+        for item in items:
+            self.remember(item['item_uuid'])
+            self._remember_details(item)
+
+    def is_cached(self, item_uuid):
+        """
+        Check the in-process cache only
+
+        :param item_uuid: UUID of the item
+        :return: True if the item is known to exist
+        """
+        with self._lock:
+            expires_at = self._known.get(item_uuid)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._known[item_uuid]
+                return False
+            return True
+
+
+class ItemCatalog(LocalItemCache):
+    """
+    Answers whether an item exists without calling items_service when possible
+
+    :param redis_client: Redis client holding the shared known_items set
+    :param items_service_url: Base URL of the items endpoints, ending with a slash
+    :param items_batch_url: URL of the items_service batch lookup endpoint
+    :param session: requests session used to call items_service
+    :param timeout: (connect, read) timeout of calls to items_service, in seconds
+    """
+    def __init__(self, redis_client, items_service_url, items_batch_url, session, timeout=(0.5, 2), **kwargs):
+        super().__init__(**kwargs)
+        self.redis_client = redis_client
+        self.items_service_url = items_service_url
+        self.items_batch_url = items_batch_url
+        self.session = session
+        self.timeout = timeout
+
+    def _fetch(self, item_uuids):
+        """
+        Look up items with batched items_service calls and cache what was found
+
+        :param item_uuids: UUIDs of the items
+        :return: Dictionary of the found items by item_uuid
+        """
+        found = {}
+        for start in range(0, len(item_uuids), BATCH_SIZE):
+            response = self.session.get(self.items_batch_url,
+                                        params=[('id', item_uuid) for item_uuid in item_uuids[start:start + BATCH_SIZE]],
+                                        timeout=self.timeout)
+            response.raise_for_status()
+            items = response.json()['items']
+            self._remember_found(items)
+            found.update((item['item_uuid'], item) for item in items)
+        return found
+
+    def get_many(self, item_uuids):
+        """
+        Get the details of several items, from the details cache where possible and with batched items_service
+        calls otherwise. Raises requests.RequestException if items_service has to be asked and fails
+
+        :param item_uuids: UUIDs of the items
+        :return: Dictionary of the found items by item_uuid. Items that do not exist are left out
+        """
+        found = self.cached_details(item_uuids)
+        remaining = [item_uuid for item_uuid in dict.fromkeys(item_uuids) if item_uuid not in found]
+        if remaining:
+            found.update(self._fetch(remaining))
+        return found
+
+    def exists(self, item_uuid):
+        """
+        Check whether an item exists. Raises requests.RequestException if items_service has to be asked and fails
+
+        items_service is asked through the batch lookup endpoint, never by appending the UUID to the items URL, so
+        an id like 'export' cannot reach another items_service route
+        :param item_uuid: UUID of the item, as a canonical string
+        :return: True if the item exists
+        """
+        if self.is_cached(item_uuid):
+            return True
+        try:
+            if self.redis_client.sismember(KNOWN_ITEMS_KEY, item_uuid):
+                self.remember(item_uuid)
+                return True
+        except redis.RedisError:
+            logger.exception("Could not read the known items set")
+        return item_uuid in self._fetch([item_uuid])
+
+    def exists_many(self, item_uuids):
+        """
+        Check whether several items exist, with at most one Redis call and one batched items_service call.
+        Raises requests.RequestException if items_service has to be asked and fails
+
+        :param item_uuids: UUIDs of the items
+        :return: Dictionary of item_uuid to True if the item exists, False otherwise
+        """
+        result = {item_uuid: True for item_uuid in item_uuids if self.is_cached(item_uuid)}
+        remaining = [item_uuid for item_uuid in dict.fromkeys(item_uuids) if item_uuid not in result]
+        if remaining:
+            try:
+                known = self.redis_client.smismember(KNOWN_ITEMS_KEY, remaining)
+            except redis.RedisError:
+                logger.exception("Could not read the known items set")
+                known = [False] * len(remaining)
+            for item_uuid, is_known in zip(remaining, known):
+                if is_known:
+                    self.remember(item_uuid)
+                    result[item_uuid] = True
+            remaining = [item_uuid for item_uuid in remaining if item_uuid not in result]
+        if remaining:
+            found = self._fetch(remaining)
+            for item_uuid in remaining:
+                result[item_uuid] = item_uuid in found
+        return result
+
+    def _full_load(self, lock):
+        """
+        Rebuild the known_items set from the catalog export
+
+        :param lock: The sync lock, extended while the export is read
+        :return: Catalog version the export was taken at, or None if the lock was lost and the load abandoned
+        """
+        with self.session.get(self.items_service_url + 'export', stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            version = int(response.headers.get('X-Catalog-Version', 0))
+            self.redis_client.delete(LOADING_KEY)
+            batch = []
+            for line in response.iter_lines():
+                if line:
+                    batch.append(json.loads(line)['item_uuid'])
+                if len(batch) == 1000:
+                    self.redis_client.sadd(LOADING_KEY, *batch)
+                    # Large catalogs take a while, keep other replicas from starting a second load
+                    if not lock.extend():
+                        logger.warning("Lost the known items lock during a full load, leaving it to its new holder")
+                        return None
+                    batch = []
+            if batch:
+                self.redis_client.sadd(LOADING_KEY, *batch)
+        if self.redis_client.exists(LOADING_KEY):
+            self.redis_client.rename(LOADING_KEY, KNOWN_ITEMS_KEY)
+        else:
+            self.redis_client.delete(KNOWN_ITEMS_KEY)
+        # Set after the swap, so a sync failing in between loads again rather than missing changes
+        self.redis_client.set(VERSION_KEY, version)
+        return version
+
+    def sync(self):
+        """
+        Bring the known_items set up to date with the catalog. Only one replica syncs at a time
+        """
+        lock = RedisLock(self.redis_client, LOCK_KEY, LOCK_SECONDS)
+        if not lock.acquire():
+            return
+        try:
+            version = self.redis_client.get(VERSION_KEY)
+            if version is None:
+                self._full_load(lock)
+                return
+            version = int(version)
+            while True:
+                response = self.session.get(self.items_service_url + 'changes',
+                                            params={'since': version}, timeout=self.timeout)
+                if response.status_code == 410:
+                    self._full_load(lock)
+                    return
+                response.raise_for_status()
+                page = response.json()
+                pipeline = self.redis_client.pipeline()
+                for change in page['changes']:
+                    if change['op'] == 'delete':
+                        pipeline.srem(KNOWN_ITEMS_KEY, change['item_uuid'])
+                    else:
+                        pipeline.sadd(KNOWN_ITEMS_KEY, change['item_uuid'])
+                version = page['version']
+                pipeline.set(VERSION_KEY, version)
+                pipeline.execute()
+                if not page['has_more']:
+                    return
+                if not lock.extend():
+                    logger.warning("Lost the known items lock during a sync, leaving it to its new holder")
+                    return
+        finally:
+            lock.release()
+
+    def start_sync(self, interval):
+        """
+        Keep the known_items set in sync from a daemon thread
+
+        :param interval: Seconds between syncs
+        """
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except (redis.RedisError, requests.RequestException, ValueError):
+                    logger.exception("Could not sync the known items set")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='item-catalog-sync', daemon=True).start()
+
+
+class AsyncItemCatalog(LocalItemCache):
+    """
+    asyncio version of ItemCatalog's lookups, for the ASGI app
+
+    :param redis_client: redis.asyncio client holding the shared known_items set
+    :param items_service_url: Base URL of the items endpoints, ending with a slash
+    :param items_batch_url: URL of the items_service batch lookup endpoint
+    :param http_client: httpx.AsyncClient used to call items_service
+    """
+    def __init__(self, redis_client, items_service_url, items_batch_url, http_client, **kwargs):
+        super().__init__(**kwargs)
+        self.redis_client = redis_client
+        self.items_service_url = items_service_url
+        self.items_batch_url = items_batch_url
+        self.http_client = http_client
+
+    async def _fetch(self, item_uuids):
+        found = {}
+        for start in range(0, len(item_uuids), BATCH_SIZE):
+            response = await self.http_client.get(
+                self.items_batch_url, params=[('id', item_uuid) for item_uuid in item_uuids[start:start + BATCH_SIZE]]
+            )
+            response.raise_for_status()
+            items = response.json()['items']
+            self._remember_found(items)
+            found.update((item['item_uuid'], item) for item in items)
+        return found
+
+    async def get_many(self, item_uuids):
+        """
+        See ItemCatalog.get_many. Raises httpx.HTTPError if items_service has to be asked and fails
+        """
+        found = self.cached_details(item_uuids)
+        remaining = [item_uuid for item_uuid in dict.fromkeys(item_uuids) if item_uuid not in found]
+        if remaining:
+            found.update(await self._fetch(remaining))
+        return found
+
+    async def exists(self, item_uuid):
+        """
+        See ItemCatalog.exists. Raises httpx.HTTPError if items_service has to be asked and fails
+        """
+        if self.is_cached(item_uuid):
+            return True
+        try:
+            if await self.redis_client.sismember(KNOWN_ITEMS_KEY, item_uuid):
+                self.remember(item_uuid)
+                return True
+        except redis.RedisError:
+            logger.exception("Could not read the known items set")
+        return item_uuid in await self._fetch([item_uuid])
+
+    async def exists_many(self, item_uuids):
+        """
+        See ItemCatalog.exists_many. Raises httpx.HTTPError if items_service has to be asked and fails
+        """
+        result = {item_uuid: True for item_uuid in item_uuids if self.is_cached(item_uuid)}
+        remaining = [item_uuid for item_uuid in dict.fromkeys(item_uuids) if item_uuid not in result]
+        if remaining:
+            try:
+                known = await self.redis_client.smismember(KNOWN_ITEMS_KEY, remaining)
+            except redis.RedisError:
+                logger.exception("Could not read the known items set")
+                known = [False] * len(remaining)
+            for item_uuid, is_known in zip(remaining, known):
+                if is_known:
+                    self.remember(item_uuid)
+                    result[item_uuid] = True
+            remaining = [item_uuid for item_uuid in remaining if item_uuid not in result]
+        if remaining:
+            found = await self._fetch(remaining)
+            for item_uuid in remaining:
+                result[item_uuid] = item_uuid in found
+        return result
@@ -0,0 +1,137 @@
+"""
+Rewrite basket keys to the hash-tagged layout
+
+Baskets used to be stored as <basket_id>, basket_lines:<basket_id> and, before that, as a list with one entry per
+unit under basket_items:<basket_id>. These keys have no common hash tag, so they cannot be used on a Redis Cluster.
+This command scans the old server and writes every basket to the configured Redis (settings.py, or a cluster with
+REDIS_CLUSTER=1) as basket:{<basket_id>} and basket_lines:{<basket_id>}, keeping the remaining TTL or giving the
+basket TTL to keys that had none. List baskets are converted to line quantities on the way.
+
+Every basket is written as a whole, merged from all its old keys, and its old keys are deleted once it is written,
+so the command can be stopped and run again. The untagged known_items keys are deleted as well, the sync thread
+rebuilds them under the new names. Stop the old basket_service replicas before running it, baskets written during the
+run by an old replica would be left behind.
+
+Usage: python migrate_keys.py --source-url redis://redis:6379/0
+"""
+import argparse
+import time
+import uuid
+from collections import Counter
+
+import redis
+
+from basket_store import basket_key, lines_key
+from redis_connection import create_redis_client
+from settings import basket_ttl, redis_db, redis_host, redis_port
+
+OLD_LINES_PREFIX = 'basket_lines:'
+OLD_LIST_PREFIX = 'basket_items:'
+OLD_KNOWN_ITEMS_KEYS = ['known_items', 'known_items:loading', 'known_items:version', 'known_items:lock']
+
+
+def old_basket_key(key):
+    """
+    :param key: Redis key
+    :return: Tuple of the kind of old basket key ('basket', 'lines' or 'list') and the basket ID, or None
+    """
+    for kind, prefix in (('lines', OLD_LINES_PREFIX), ('list', OLD_LIST_PREFIX)):
+        if key.startswith(prefix) and '{' not in key:
+            return kind, key[len(prefix):]
+    try:
+        uuid.UUID(key)
+    except ValueError:
+        return None
+    return 'basket', key
+
+
+def migrate_batch(source, target, keys, ttl, keep_source, report):
+    """
+    Write the baskets of one SCAN batch in the new layout and delete their old keys
+
+    Every basket is read from all its old keys, not only the ones in the batch, and its lines are written as a whole
+    with DEL and HSET. Writing a basket again, e.g. after the command was stopped before deleting its old keys,
+    therefore gives the same result.
+    :param source: Client of the old server
+    :param target: Client of the new server or cluster
+    :param keys: Keys returned by SCAN
+    :param ttl: TTL in seconds for keys that had none
+    :param keep_source: Whether to keep the old keys
+    :param report: Migration report to be updated
+    """
+    basket_ids = list(dict.fromkeys(old[1] for old in map(old_basket_key, keys) if old is not None))
+    if not basket_ids:
+        return
+    pipeline = source.pipeline(transaction=False)
+    for basket_id in basket_ids:
+        pipeline.hgetall(basket_id)
+        pipeline.pttl(basket_id)
+        pipeline.hgetall(OLD_LINES_PREFIX + basket_id)
+        pipeline.pttl(OLD_LINES_PREFIX + basket_id)
+        pipeline.lrange(OLD_LIST_PREFIX + basket_id, 0, -1)
+        pipeline.pttl(OLD_LIST_PREFIX + basket_id)
+    results = pipeline.execute()
+
+    pipeline = target.pipeline(transaction=False)
+    migrated = []
+    for index, basket_id in enumerate(basket_ids):
+        basket, basket_pttl, lines, lines_pttl, units, units_pttl = results[6 * index:6 * index + 6]
+        if not (basket or lines or units):
+            # Migrated by an earlier batch, or expired since SCAN returned it
+            continue
+        if basket:
+            pipeline.delete(basket_key(basket_id))
+            pipeline.hset(basket_key(basket_id), mapping=basket)
+            pipeline.pexpire(basket_key(basket_id), basket_pttl if basket_pttl > 0 else ttl * 1000)
+            migrated.append(basket_id)
+            report['basket'] += 1
+        if lines or units:
+            quantities = Counter(units)
+            for item_uuid, quantity in lines.items():
+                quantities[item_uuid] += int(quantity)
+            expire_ms = [pttl if pttl > 0 else ttl * 1000
+                         for pttl, value in ((lines_pttl, lines), (units_pttl, units)) if value]
+            pipeline.delete(lines_key(basket_id))
+            pipeline.hset(lines_key(basket_id), mapping=quantities)
+            pipeline.pexpire(lines_key(basket_id), max(expire_ms))
+        if lines:
+            migrated.append(OLD_LINES_PREFIX + basket_id)
+            report['lines'] += 1
+        if units:
+            migrated.append(OLD_LIST_PREFIX + basket_id)
+            report['list'] += 1
+    pipeline.execute()
+
+    if migrated and not keep_source:
+        source.unlink(*migrated)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rewrite basket keys to the hash-tagged layout')
+    parser.add_argument('--source-url', default=f'redis://{redis_host}:{redis_port}/{redis_db}',
+                        help='URL of the Redis server holding the old keys')
+    parser.add_argument('--batch-size', type=int, default=500, help='number of keys asked for per SCAN call')
+    parser.add_argument('--ttl', type=int, default=basket_ttl, help='TTL in seconds for keys that had none')
+    parser.add_argument('--keep-source', action='store_true',
+                        help='keep the old keys, running the command again then writes the same baskets again')
+    args = parser.parse_args()
+
+    source = redis.StrictRedis.from_url(args.source_url, decode_responses=True)
+    target = create_redis_client()
+    report = Counter(basket=0, lines=0, list=0)
+    started = time.perf_counter()
+    batch = []
+    for key in source.scan_iter(count=args.batch_size):
+        batch.append(key)
+        if len(batch) == args.batch_size:
+            migrate_batch(source, target, batch, args.ttl, args.keep_source, report)
+            batch = []
+    migrate_batch(source, target, batch, args.ttl, args.keep_source, report)
+    if not args.keep_source:
+        source.delete(*OLD_KNOWN_ITEMS_KEYS)
+    print(f"Migrated {report['basket']} baskets, {report['lines']} lines hashes and {report['list']} list baskets "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Redis clients for basket_service
+
+In standalone mode the clients use a blocking pool, so a burst of requests waits up to redis_pool_timeout for a free
+connection instead of opening an unbounded number of them. In cluster mode every node gets its own pool of
+redis_max_connections connections.
+
+All keys of a basket share the {basket_id} hash tag, and the known items keys the {known_items} one, so the multi-key
+scripts and commands of basket_service always stay on one slot.
+"""
+import redis
+import redis.asyncio
+import redis.asyncio.cluster
+
+from settings import (
+    redis_cluster, redis_connect_timeout, redis_db, redis_host, redis_max_connections, redis_pool_timeout,
+    redis_port, redis_socket_timeout
+)
+
+CONNECTION_OPTIONS = {
+    'decode_responses': True,
+    'socket_connect_timeout': redis_connect_timeout,
+    'socket_timeout': redis_socket_timeout,
+    'socket_keepalive': True,
+    'health_check_interval': 30
+}
+
+
+def create_redis_client():
+    """
+    :return: Redis client for the configured standalone server or cluster
+    """
+    if redis_cluster:
+        return redis.RedisCluster(host=redis_host, port=redis_port, max_connections=redis_max_connections,
+                                  **CONNECTION_OPTIONS)
+    pool = redis.BlockingConnectionPool(host=redis_host, port=redis_port, db=redis_db,
+                                        max_connections=redis_max_connections, timeout=redis_pool_timeout,
+                                        **CONNECTION_OPTIONS)
+    return redis.StrictRedis(connection_pool=pool)
+
+
+def create_async_redis_client():
+    """
+    :return: redis.asyncio client for the configured standalone server or cluster
+    """
+    if redis_cluster:
+        return redis.asyncio.cluster.RedisCluster(host=redis_host, port=redis_port,
+                                                  max_connections=redis_max_connections, **CONNECTION_OPTIONS)
+    pool = redis.asyncio.BlockingConnectionPool(host=redis_host, port=redis_port, db=redis_db,
+                                                max_connections=redis_max_connections, timeout=redis_pool_timeout,
+                                                **CONNECTION_OPTIONS)
+    return redis.asyncio.StrictRedis(connection_pool=pool)
@@ -0,0 +1,65 @@
+"""
+Redis lock held by one replica at a time for background jobs
+
+The lock's value is a random token of the holder. It is only extended and released if it still holds that token, so a
+job that runs past the lock's expiry cannot extend or free a lock another replica has taken since.
+"""
+import uuid
+
+# KEYS: lock. ARGV: token. Deletes the lock if it is still held with the token
+RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: lock. ARGV: token, seconds. Extends the lock if it is still held with the token
+EXTEND = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class RedisLock:
+    """
+    Lock on a Redis key that expires if its holder stops extending it
+
+    :param redis_client: Redis client created with decode_responses=True
+    :param key: Key of the lock
+    :param seconds: How long the lock is held unless it is extended
+    """
+    def __init__(self, redis_client, key, seconds):
+        self.redis_client = redis_client
+        self.key = key
+        self.seconds = seconds
+        self.token = None
+        self._release = redis_client.register_script(RELEASE)
+        self._extend = redis_client.register_script(EXTEND)
+
+    def acquire(self):
+        """
+        :return: Whether the lock was free and is now held
+        """
+        token = uuid.uuid4().hex
+        if not self.redis_client.set(self.key, token, nx=True, ex=self.seconds):
+            return False
+        self.token = token
+        return True
+
+    def extend(self):
+        """
+        Hold the lock for another `seconds`
+
+        :return: False if the lock expired and may be held by another replica by now
+        """
+        return bool(self._extend(keys=[self.key], args=[self.token, self.seconds]))
+
+    def release(self):
+        """
+        Free the lock, unless it expired and was taken by another replica meanwhile
+        """
+        self._release(keys=[self.key], args=[self.token])
+        self.token = None
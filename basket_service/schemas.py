@@ -0,0 +1,203 @@
+"""
+Schemas shared by the Flask app (app.py) and the ASGI app (asgi_app.py)
+"""
+from apiflask import Schema
+from apiflask.fields import String, UUID, Integer, List, Nested, Float
+from apiflask.validators import Length, Range
+
+from settings import max_basket_lines, max_bulk_items
+
+
+class ItemUUID(UUID):
+    """
+    UUID field loaded as its canonical string, the form item_uuids are stored in and sent to items_service in
+    """
+    def _deserialize(self, value, attr, data, **kwargs):
+        return str(super()._deserialize(value, attr, data, **kwargs))
+
+
+class BasketItemIn(Schema):
+    """
+    Basket Item Schema
+
+    :param item_uuid: Unique identifier for the item
+    """
+    item_uuid = ItemUUID(required=True)
+
+
+class BasketItemOut(Schema):
+    """
+    Basket Item Schema for output endpoints
+
+    :param item_uuid: Unique identifier for the item
+    :param url: URL of the item in the items_service
+    :param quantity: Number of units of the item in the basket
+    """
+    item_uuid = UUID()
+    item_url = String()
+    quantity = Integer()
+
+
+class BasketLineIn(Schema):
+    """
+    Basket Line Schema for bulk adds
+
+    :param item_uuid: Unique identifier for the item
+    :param quantity: Number of units to add
+    """
+    item_uuid = ItemUUID(required=True)
+    quantity = Integer(load_default=1, validate=Range(min=1))
+
+
+class BasketLinesIn(Schema):
+    """
+    Bulk Add Schema
+
+    :param items: Lines to add to the basket
+    """
+    items = List(Nested(BasketLineIn), required=True, validate=Length(min=1, max=max_bulk_items))
+
+
+class BasketLineResultOut(Schema):
+    """
+    Bulk Add Result Schema for a single line
+
+    :param item_uuid: Unique identifier for the item
+    :param quantity: Number of units requested
+    :param status: 'accepted' or 'rejected'
+    :param reason: Why the line was rejected
+    """
+    item_uuid = String()
+    quantity = Integer()
+    status = String()
+    reason = String()
+
+
+class BasketLinesOut(Schema):
+    """
+    Bulk Add Result Schema
+
+    :param results: Result of every line, in request order
+    """
+    results = List(Nested(BasketLineResultOut))
+
+
+class BasketQuantityIn(Schema):
+    """
+    Basket Quantity Schema
+
+    :param quantity: New number of units of the item, 0 removes the item from the basket
+    """
+    quantity = Integer(required=True, validate=Range(min=0))
+
+
+class BasketLineOut(Schema):
+    """
+    Basket Line Schema for expanded baskets
+
+    :param item_uuid: Unique identifier for the item
+    :param item_url: URL of the item in the items_service
+    :param quantity: Number of units of the item in the basket
+    :param item_name: Name of the item
+    :param item_price: Price of one unit of the item
+    :param line_total: Price of all units of the item
+    """
+    item_uuid = UUID()
+    item_url = String()
+    quantity = Integer()
+    item_name = String()
+    item_price = Float()
+    line_total = Float()
+
+
+class BasketExpandedOut(Schema):
+    """
+    Expanded Basket Schema
+
+    :param basket_id: Unique identifier for the basket
+    :param items: Lines of the basket with item details
+    :param missing: UUIDs of items in the basket that no longer exist
+    :param total: Price of the whole basket
+    """
+    basket_id = String()
+    items = List(Nested(BasketLineOut))
+    missing = List(String())
+    total = Float()
+
+
+class BasketIDOut(Schema):
+    """
+    Basket ID Schema
+
+    :param basket_id: Unique identifier for the basket
+    """
+    basket_id = String()
+
+
+class AddItemQuery(Schema):
+    """
+    Add Item Query Schema
+
+    :param item_uuid: Unique identifier for the item
+    :param quantity: Number of units to add
+    """
+    item_uuid = ItemUUID(required=True)
+    quantity = Integer(load_default=1, validate=Range(min=1))
+
+
+class BasketRemoveIn(Schema):
+    """
+    Bulk Remove Schema
+
+    :param items: Lines to remove units from
+    :param checkout_id: Order the units were checked out into, the units of an order are only removed once
+    """
+    items = List(Nested(BasketLineIn), required=True, validate=Length(min=1, max=max_basket_lines))
+    checkout_id = String(validate=Length(1, 200))
+
+
+class DecrementQuery(Schema):
+    """
+    Decrement Query Schema
+
+    :param quantity: Number of units to remove
+    """
+    quantity = Integer(load_default=1, validate=Range(min=1))
+
+
+class SweepReportOut(Schema):
+    """
+    Basket Sweep Report Schema
+
+    :param started_at: When the sweep started
+    :param seconds: How long the sweep took
+    :param baskets: Number of baskets found
+    :param keys: Number of basket keys kept
+    :param key_memory_bytes: Memory used by the basket keys kept
+    :param orphans_deleted: Number of lines keys deleted because their basket was gone
+    :param expiry_set: Number of keys without an expiry that were given the basket TTL
+    """
+    started_at = String()
+    seconds = Float()
+    baskets = Integer()
+    keys = Integer()
+    key_memory_bytes = Integer()
+    orphans_deleted = Integer()
+    expiry_set = Integer()
+
+
+class BasketStatsOut(Schema):
+    """
+    Basket Stats Schema
+
+    :param baskets: Number of baskets found by the last sweep
+    :param key_memory_bytes: Memory used by basket keys at the last sweep
+    :param used_memory_bytes: Memory currently used by Redis
+    :param ttl_seconds: Seconds without access after which a basket expires
+    :param sweeps: Reports of the last sweeps, newest first
+    """
+    baskets = Integer(allow_none=True)
+    key_memory_bytes = Integer(allow_none=True)
+    used_memory_bytes = Integer()
+    ttl_seconds = Integer()
+    sweeps = List(Nested(SweepReportOut))
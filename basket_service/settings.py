@@ -0,0 +1,31 @@
+"""
+Settings shared by the Flask app (app.py) and the ASGI app (asgi_app.py)
+
+The Redis connection can be changed per deployment through environment variables.
+"""
+import os
+
+redis_host = os.environ.get('REDIS_HOST', 'redis')
+redis_port = int(os.environ.get('REDIS_PORT', 6379))
+redis_db = 0
+# With REDIS_CLUSTER=1, redis_host and redis_port are the startup node of a Redis Cluster
+redis_cluster = os.environ.get('REDIS_CLUSTER', '0') == '1'
+# Maximum number of connections per process, per node in cluster mode
+redis_max_connections = int(os.environ.get('REDIS_MAX_CONNECTIONS', 64))
+# Seconds to wait for a free pooled connection, and connect and read timeouts
+redis_pool_timeout = 1
+redis_connect_timeout = 0.5
+redis_socket_timeout = 1
+
+items_service_url = 'http://items_service:5000/api/v1/items/'
+items_batch_url = 'http://items_service:5000/api/v1/item_uuid'
+# Maximum number of lines of a bulk add, items_service looks up at most 1000 ids at once
+max_bulk_items = 500
+# Seconds between syncs of the shared known items set with the items_service change feed
+item_sync_interval = 5
+# Seconds without access after which a basket and its lines expire
+basket_ttl = 7 * 24 * 3600
+# Seconds between sweeps of orphaned basket keys
+basket_sweep_interval = 300
+# Maximum number of different items in one basket
+max_basket_lines = 1000
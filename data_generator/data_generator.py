@@ -12,16 +12,12 @@ num_threads = 10
 
 
 def add_random_items_to_basket(basket_id):
-    # Add random items to the basket
+    # Add random items to the basket in a single request
     num_items = random.randint(min_items_per_basket, max_items_per_basket)
-    for _ in range(num_items):
-        item = random.choice(all_items)
-        item_uuid = item['item_uuid']
-        add_item_response = requests.post(
-            f'{basket_service_base_url}/{basket_id}/add_item?item_uuid={item_uuid}'
-        )
-        add_item_response.raise_for_status()
-        print(f"Added item {item_uuid} to basket {basket_id}")
+    lines = [{'item_uuid': random.choice(all_items)['item_uuid']} for _ in range(num_items)]
+    add_items_response = requests.post(f'{basket_service_base_url}/{basket_id}/add_items', json={'items': lines})
+    add_items_response.raise_for_status()
+    print(f"Added {num_items} items to basket {basket_id}")
 
 
 # Get all available items from the items_service
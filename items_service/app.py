@@ -1,15 +1,45 @@
+import base64
+import binascii
+import hashlib
 import json
+import os
+import zlib
 
 from apiflask import APIFlask, Schema, abort
-from apiflask.fields import Integer, String, Float, UUID, List
+from apiflask.fields import Integer, String, Float, UUID, List, Nested, Boolean
+from apiflask.validators import OneOf, Range
 from bson import ObjectId
+from flask import Response, request
 from flask.json import JSONEncoder
 from flask_cors import CORS
 from flask_pymongo import PyMongo
+from pymongo.errors import PyMongoError
+from werkzeug.http import quote_etag
+import orjson
+import redis
 import uuid
 
+import search
+from bulk_import import import_ndjson
+from cache import ItemCache
+from changes import ChangeLog, ChangesExpired
+
 
 DB_URL = "mongodb://mongo:27017/eCommerceApp"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_SEARCH_OFFSET = 10000
+AUTOCOMPLETE_LIMIT = 10
+EXPORT_BATCH_SIZE = 1000
+# Sort orders accepted by the listing and search endpoints. Ties are broken by item_uuid so paging is stable
+SORT_FIELDS = {'uuid': 'item_uuid', 'price': 'item_price', 'name': 'item_name'}
+IMPORT_CHUNK_SIZE = 1000
+MAX_CHANGES_PAGE_SIZE = 10000
+MAX_IMPORT_ERRORS = 1000
+ITEM_CACHE_SIZE = 10000
+ITEM_CACHE_TTL = 30
+# e.g. redis://redis:6379/1 to share cached items between replicas
+ITEM_CACHE_REDIS_URL = os.environ.get('ITEM_CACHE_REDIS_URL')
 
 
 class Items(Schema):
@@ -40,6 +70,21 @@ class ItemsIn(Schema):
     item_price = Float(required=True)
 
 
+class ItemsImport(Schema):
+    """
+    Item Schema for rows of a bulk import
+
+    :param item_uuid: Optional unique identifier the row is upserted on
+    :param item_name: Name of the item
+    :param item_description: Description of the item
+    :param item_price: Price of the item
+    """
+    item_uuid = UUID()
+    item_name = String(required=True)
+    item_description = String(required=True)
+    item_price = Float(required=True)
+
+
 class ItemsOut(Schema):
     """
     Item Schema for output endpoints
@@ -55,6 +100,112 @@ class ItemsOut(Schema):
     item_price = Float()
 
 
+ITEM_PROJECTION = {**{field: 1 for field in ItemsOut().fields}, '_id': 0}
+
+
+class ChangeOut(Schema):
+    """
+    Schema for a catalog change
+
+    :param version: Catalog version of the change
+    :param op: 'upsert' or 'delete'
+    :param item_uuid: Unique identifier of the changed item
+    :param item: The item after an upsert, null after a delete
+    """
+    version = Integer()
+    op = String()
+    item_uuid = String()
+    item = Nested(ItemsOut, allow_none=True)
+
+
+class ChangesOut(Schema):
+    """
+    Schema for a page of the catalog change feed
+
+    :param changes: Changes, oldest first
+    :param version: Catalog version to pass as `since` to get the next changes
+    :param has_more: Whether more changes are available right away
+    """
+    changes = List(Nested(ChangeOut))
+    version = Integer()
+    has_more = Boolean()
+
+
+class ItemsBatchOut(Schema):
+    """
+    Schema for batched item lookups
+
+    :param items: Found items, in the order their UUIDs were requested
+    :param missing: Requested UUIDs that do not exist
+    """
+    items = List(Nested(ItemsOut))
+    missing = List(String())
+
+
+class AutocompleteOut(Schema):
+    """
+    Schema for autocomplete suggestions
+
+    :param suggestions: Names of the items matching the typed prefix
+    """
+    suggestions = List(String())
+
+
+class ImportErrorOut(Schema):
+    """
+    Schema for a row rejected by a bulk import
+
+    :param line: Line number of the row in the request body
+    :param error: Why the row was rejected
+    """
+    line = Integer()
+    error = String()
+
+
+class ImportReportOut(Schema):
+    """
+    Schema for the result of a bulk import
+
+    :param received: Number of non-empty lines read
+    :param inserted: Number of new items
+    :param updated: Number of existing items overwritten by an upsert
+    :param failed: Number of rejected rows
+    :param errors: Rejected rows, up to MAX_IMPORT_ERRORS of them
+    :param seconds: Time taken by the import
+    :param rows_per_second: Import throughput
+    """
+    received = Integer()
+    inserted = Integer()
+    updated = Integer()
+    failed = Integer()
+    errors = List(Nested(ImportErrorOut))
+    seconds = Float()
+    rows_per_second = Float()
+
+
+class CacheStatsOut(Schema):
+    """
+    Schema for the item cache counters
+
+    :param size: Number of items currently cached in process
+    :param max_size: Maximum number of items cached in process
+    :param hits: Lookups served from the in-process cache
+    :param shared_hits: Lookups served from the shared Redis cache
+    :param misses: Lookups that had to go to Mongo
+    :param evictions: Items dropped because the cache was full
+    :param expirations: Items dropped because their TTL had passed
+    :param shared_errors: Failed calls to the shared Redis cache
+    """
+    size = Integer()
+    max_size = Integer()
+    hits = Integer()
+    shared_hits = Integer()
+    misses = Integer()
+    evictions = Integer()
+    expirations = Integer()
+    shared_errors = Integer()
+
+
 class CustomJSONEncoder(JSONEncoder):
     def default(self, obj):
         """
@@ -68,106 +219,403 @@ class CustomJSONEncoder(JSONEncoder):
         return super(CustomJSONEncoder, self).default(obj)
 
 
+def encode_cursor(item, sort_field='item_uuid'):
+    """
+    Build an opaque pagination cursor pointing just past the given item
+
+    :param item: Last item of the current page
+    :param sort_field: Field the page is sorted on
+    :return: URL-safe cursor string
+    """
+    payload = {'item_uuid': item['item_uuid']}
+    if sort_field != 'item_uuid':
+        payload.update({'sort': sort_field, 'value': item.get(sort_field)})
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor, sort_field='item_uuid'):
+    """
+    Decode a cursor produced by encode_cursor into a query for the items after it.
+    Aborts with 400 if the cursor is malformed or was built for another sort order
+
+    :param cursor: Cursor string sent by the client
+    :param sort_field: Field the page is sorted on
+    :return: Mongo query matching the items after the cursor
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        item_uuid = payload['item_uuid']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        abort(400, "Invalid cursor")
+    # The values end up in the Mongo query, a forged cursor must not be able to smuggle operators like $ne into it
+    if not isinstance(item_uuid, str):
+        abort(400, "Invalid cursor")
+    if payload.get('sort', 'item_uuid') != sort_field:
+        abort(400, "Cursor does not match the sort order")
+    if sort_field == 'item_uuid':
+        return {'item_uuid': {'$gt': item_uuid}}
+    value = payload.get('value')
+    value_type = (int, float) if sort_field == 'item_price' else str
+    if not isinstance(value, value_type) or isinstance(value, bool):
+        abort(400, "Invalid cursor")
+    return {'$or': [{sort_field: {'$gt': value}}, {sort_field: value, 'item_uuid': {'$gt': item_uuid}}]}
+
+
+def price_criteria(query):
+    """
+    Build the price range filter of a listing or search query
+
+    :param query: Parsed query parameters with optional min_price and max_price
+    :return: Mongo query, empty if no price range was given
+    """
+    price_range = {}
+    if 'min_price' in query:
+        price_range['$gte'] = query['min_price']
+    if 'max_price' in query:
+        price_range['$lte'] = query['max_price']
+    return {'item_price': price_range} if price_range else {}
+
+
+def keyset_page(criteria, sort_field, limit, after=None):
+    """
+    Fetch one page of items sorted on sort_field and item_uuid, continuing after the given cursor
+
+    With the compound indexes created by bootstrap.py this is a bounded index range scan however deep the page is.
+    :param criteria: Mongo query the items have to match
+    :param sort_field: Field to sort on
+    :param limit: Page size
+    :param after: Optional cursor of the previous page
+    :return: JSON response with the items and, if there are more, an X-Next-Cursor header
+    """
+    if after:
+        criteria = {'$and': [criteria, decode_cursor(after, sort_field)]}
+    sort = [(sort_field, 1), ('item_uuid', 1)] if sort_field != 'item_uuid' else [('item_uuid', 1)]
+    # Fetch one extra item to find out whether there is a next page
+    items = list(mongo.db.items.find(criteria, ITEM_PROJECTION).sort(sort).limit(limit + 1))
+    if len(items) > limit:
+        items = items[:limit]
+        return json_response(items, {'X-Next-Cursor': encode_cursor(items[-1], sort_field)})
+    return json_response(items)
+
+
+def generate_ndjson(cursor, compress=False):
+    """
+    Write items as newline-delimited JSON, one chunk per cursor batch, so memory use does not depend on the catalog size
+
+    :param cursor: Mongo cursor over the items to be written
+    :param compress: Whether to gzip the output
+    :return: Generator of response chunks
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    lines = []
+    for item in cursor:
+        lines.append(orjson.dumps(item))
+        if len(lines) == EXPORT_BATCH_SIZE:
+            chunk = b'\n'.join(lines) + b'\n'
+            lines = []
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else chunk
+    chunk = b'\n'.join(lines) + b'\n' if lines else b''
+    yield compressor.compress(chunk) + compressor.flush() if compressor else chunk
+
+
+def json_response(data, headers=None):
+    """
+    Serialize data straight to JSON with orjson, skipping the marshmallow dump of @app.output
+
+    Only for data that already has the shape of the endpoint's output schema, e.g. items read with ITEM_PROJECTION.
+    The output schema is still what the OpenAPI spec documents.
+    :param data: Response body
+    :param headers: Optional response headers
+    :return: JSON response
+    """
+    return Response(orjson.dumps(data), mimetype='application/json', headers=headers)
+
+
+def compute_etag(data):
+    """
+    Compute a strong ETag for a JSON-serializable response body
+
+    :param data: Response body
+    :return: Unquoted ETag
+    """
+    return hashlib.sha256(orjson.dumps(data, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def conditional_response(data, etag):
+    """
+    Answer with 304 if the client already has the current representation, otherwise with the data and its ETag
+
+    :param data: Response body, shaped like the endpoint's output schema
+    :param etag: Unquoted ETag of the response body
+    :return: Response
+    """
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': quote_etag(etag)})
+    return json_response(data, {'ETag': quote_etag(etag)})
+
+
+def get_items_by_uuid(item_uuids):
+    """
+    Read-through lookup of items, served from the item cache where possible and from one Mongo query otherwise
+
+    :param item_uuids: UUIDs of the items to be retrieved
+    :return: Dictionary of the found items by item_uuid
+    """
+    return item_cache.read_through(item_uuids, lambda uncached: {
+        item['item_uuid']: item for item in mongo.db.items.find({"item_uuid": {"$in": uncached}}, ITEM_PROJECTION)
+    })
+
+
 app = APIFlask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'X-Catalog-Version'])
 app.json_encoder = CustomJSONEncoder
 
+# The indexes are created by bootstrap.py, the replicas do no Mongo work at startup
 try:
     app.config["MONGO_URI"] = DB_URL
     mongo = PyMongo(app)
-except:
-    print("Could not connect to mongo")
+    change_log = ChangeLog(mongo.db)
+except PyMongoError as e:
+    print(f"Could not connect to mongo: {e}")
     exit(1)
 
-
-# def load_sample_data(filename='sample_data.json'):
-#     with open(filename, 'r') as f:
-#         raw_data = json.load(f)
-#     data = [Items().load(item) for item in raw_data]
-#     return data
-#
-#
-# sample_data = load_sample_data()
-# for item in sample_data:
-#     mongo.db.items.insert_one(item)
+item_cache = ItemCache(
+    max_size=ITEM_CACHE_SIZE,
+    ttl=ITEM_CACHE_TTL,
+    redis_client=redis.Redis.from_url(ITEM_CACHE_REDIS_URL) if ITEM_CACHE_REDIS_URL else None
+)
 
 
 @app.get('/api/v1/items')
-@app.input({'_start': Integer(), '_end': Integer()}, location='query', schema_name='PaginationQuery')
+@app.input({
+    '_start': Integer(validate=Range(min=0)),
+    '_end': Integer(validate=Range(min=0)),
+    'after': String(),
+    'limit': Integer(validate=Range(min=1, max=MAX_PAGE_SIZE)),
+    'min_price': Float(validate=Range(min=0)),
+    'max_price': Float(validate=Range(min=0)),
+    'sort': String(load_default='uuid', validate=OneOf(SORT_FIELDS))
+}, location='query', schema_name='PaginationQuery')
 @app.output(ItemsOut(many=True))
-@app.doc(responses=[200, 404])
+@app.doc(responses=[200, 400, 404])
 def get_items(query):
     """
-    Get all items
-    :return: JSON representation of all items
+    Get a page of items, optionally filtered by price and sorted by price or name
+
+    Pages are fetched with a cursor: pass the X-Next-Cursor header of the previous response as `after`.
+    The header is omitted on the last page. `_start`/`_end` offset paging is still supported for older clients.
+    :return: JSON representation of the items
     """
-    if query:
+    criteria = price_criteria(query)
+    sort_field = SORT_FIELDS[query['sort']]
+    if '_start' in query or '_end' in query:
         start = query.get('_start', 0)
-        end = query.get('_end', 10)
-        items = mongo.db.items.find().skip(start).limit(end - start)
-    else:
-        items = mongo.db.items.find()
-    return list(items)
+        end = min(query.get('_end', 10), start + MAX_PAGE_SIZE)
+        if end <= start:
+            # limit(0) would mean no limit at all
+            return json_response([])
+        items = mongo.db.items.find(criteria, ITEM_PROJECTION).sort([(sort_field, 1), ('item_uuid', 1)]) \
+            .skip(start).limit(end - start)
+        return json_response(list(items))
+    return keyset_page(criteria, sort_field, query.get('limit', DEFAULT_PAGE_SIZE), query.get('after'))
+
+
+@app.get('/api/v1/items/export')
+@app.input({'gzip': Boolean(load_default=False)}, location='query', schema_name='ExportQuery')
+@app.doc(responses={200: 'Newline-delimited JSON, one item per line'})
+def export_items(query):
+    """
+    Stream the whole catalog as newline-delimited JSON
+
+    The X-Catalog-Version header holds the catalog version from before the export started. Consumers that keep
+    a replica of the catalog apply the change feed from that version on.
+    :param query: Whether to gzip the response
+    :return: Streaming response with one JSON item per line
+    """
+    headers = {'X-Catalog-Version': str(change_log.current_version())}
+    cursor = mongo.db.items.find({}, ITEM_PROJECTION, batch_size=EXPORT_BATCH_SIZE)
+    if query['gzip']:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(generate_ndjson(cursor, query['gzip']), mimetype='application/x-ndjson', headers=headers)
+
+
+@app.get('/api/v1/items/changes')
+@app.input({
+    'since': Integer(load_default=0, validate=Range(min=0)),
+    'limit': Integer(load_default=MAX_PAGE_SIZE, validate=Range(min=1, max=MAX_CHANGES_PAGE_SIZE))
+}, location='query', schema_name='ChangesQuery')
+@app.output(ChangesOut)
+@app.doc(responses=[200, 410])
+def get_item_changes(query):
+    """
+    Get the catalog changes after a catalog version
+
+    Responds with 410 if changes after `since` are no longer retained, in which case the consumer has to reload
+    the catalog from the export and continue from its X-Catalog-Version header.
+    :param query: Last catalog version the consumer has applied and the maximum number of changes
+    :return: Changes, the version to continue from and whether more changes are available
+    """
+    try:
+        return change_log.since(query['since'], query['limit'], ITEM_PROJECTION)
+    except ChangesExpired:
+        abort(410, "Changes after this version are no longer retained")
 
 
 @app.get('/api/v1/items/<item_uuid>')
 @app.get('/api/v1/item_uuid/<item_uuid>')
 @app.output(ItemsOut)
-@app.doc(responses=[200, 404])
+@app.doc(responses=[200, 304, 404])
 def get_item(item_uuid):
     """
-    Get an item by its UUID
+    Get an item by its UUID. Responds with 304 if If-None-Match carries the item's current ETag
     :param item_uuid: UUID of the item to be retrieved
     :return: JSON representation of the item
     """
-    item = mongo.db.items.find_one_or_404({"item_uuid": item_uuid})
-    return item
+    item = get_items_by_uuid([item_uuid]).get(item_uuid)
+    if item is None:
+        abort(404, "Item not found")
+    return conditional_response(item, compute_etag(item))
 
 
 @app.get('/api/v1/item_uuid')
 @app.input({'id': List(String())}, location='query', schema_name='StringQuery')
-@app.output(ItemsOut(many=True))
-@app.doc(responses=[200, 404])
+@app.output(ItemsBatchOut)
+@app.doc(responses=[200, 304, 400])
 def get_items_by_ids(query):
     """
-    Get multiple items by their UUIDs
+    Get multiple items by their UUIDs in a single query. Responds with 304 if If-None-Match carries the current ETag
     :param query: Query parameter that contains the UUIDs of the items to be retrieved
-    :return: JSON representation of the item
+    :return: JSON representation of the found items and the list of UUIDs that were not found
     """
-    items = []
-    ids = query.get('id')
-    if ids:
-        for uid in ids:
-            items.append(mongo.db.items.find_one_or_404({"item_uuid": uid}))
-        return items
-    else:
+    ids = list(dict.fromkeys(query.get('id') or []))
+    if not ids:
         abort(400, "No id provided")
+    if len(ids) > MAX_PAGE_SIZE:
+        abort(400, f"At most {MAX_PAGE_SIZE} ids can be requested at once")
+    found = get_items_by_uuid(ids)
+    result = {
+        'items': [found[uid] for uid in ids if uid in found],
+        'missing': [uid for uid in ids if uid not in found]
+    }
+    return conditional_response(result, compute_etag(result))
+
+
+@app.get('/api/v1/items/cache/stats')
+@app.output(CacheStatsOut)
+@app.doc(responses=[200])
+def get_cache_stats():
+    """
+    Get the item cache counters of this replica
+    :return: Cache size, hit, miss and eviction counters
+    """
+    return item_cache.stats()
 
 
 @app.get('/api/v1/items/search')
-@app.input({'search': String()}, location='query', schema_name='StringQuery')
+@app.input({
+    'search': String(required=True),
+    'prefix': Boolean(load_default=False),
+    'offset': Integer(load_default=0, validate=Range(min=0, max=MAX_SEARCH_OFFSET)),
+    'limit': Integer(load_default=DEFAULT_PAGE_SIZE, validate=Range(min=1, max=MAX_PAGE_SIZE)),
+    'after': String(),
+    'min_price': Float(validate=Range(min=0)),
+    'max_price': Float(validate=Range(min=0)),
+    'sort': String(validate=OneOf(['relevance', 'price', 'name']))
+}, location='query', schema_name='SearchQuery')
 @app.output(ItemsOut(many=True))
-@app.doc(responses=[200, 404])
-def search_items(search_term):
+@app.doc(responses=[200, 400])
+def search_items(query):
     """
-    Search items by name
-    :param search_term: Term to be searched
+    Search items by name and description, optionally filtered by price
+
+    By default this is a full-text search ranked by relevance and paged with `offset`. With `prefix` set, every
+    word of the search term is matched as the start of a word in the item name, which is what autocomplete uses.
+    Results sorted by price or name (the default for prefix searches) are paged with the X-Next-Cursor header
+    of the previous response passed as `after`.
+    :param query: Search term, filter and pagination parameters
     :return: JSON representation of the items
     """
-    search_term = search_term.get('search')
-    items = mongo.db.items.find({"item_name": {"$regex": search_term, "$options": 'i'}})
-    return list(items)
+    criteria = price_criteria(query)
+    if query['prefix']:
+        term_criteria = search.prefix_query(query['search'])
+        if term_criteria is None:
+            return json_response([])
+    else:
+        term_criteria = search.text_query(query['search'])
+        if query.get('sort', 'relevance') == 'relevance':
+            items = search.text_search(mongo.db.items, query['search'], query['offset'], query['limit'],
+                                       ITEM_PROJECTION, criteria)
+            return json_response(list(items))
+    sort_field = SORT_FIELDS['price' if query.get('sort') == 'price' else 'name']
+    return keyset_page({**criteria, **term_criteria}, sort_field, query['limit'], query.get('after'))
+
+
+@app.get('/api/v1/items/autocomplete')
+@app.input({
+    'q': String(required=True),
+    'limit': Integer(load_default=AUTOCOMPLETE_LIMIT, validate=Range(min=1, max=DEFAULT_PAGE_SIZE))
+}, location='query', schema_name='AutocompleteQuery')
+@app.output(AutocompleteOut)
+@app.doc(responses=[200])
+def autocomplete_items(query):
+    """
+    Suggest item names for a partially typed search term
+    :param query: Typed prefix and maximum number of suggestions
+    :return: Names of the matching items
+    """
+    items = search.prefix_search(mongo.db.items, query['q'], 0, query['limit'], {'item_name': 1, '_id': 0})
+    return {'suggestions': [item['item_name'] for item in items]}
+
+
+def stored_item(item, version):
+    """
+    :param item: Item to be written
+    :param version: Catalog version reserved for the write
+    :return: The document stored for the item, with its search fields and catalog version
+    """
+    return {**item, **search.index_fields(item), 'catalog_version': version}
+
+
+def older_than(item_uuid, version):
+    """
+    :param item_uuid: UUID of the item
+    :param version: Catalog version reserved for a write of the item
+    :return: Query matching the item unless a write with a later version already reached it
+    """
+    return {'item_uuid': item_uuid, 'catalog_version': {'$not': {'$gt': version}}}
+
+
+def record_changes(op, items, versions):
+    """
+    Record the changes of items that were already written. A failure is only logged, the items carry their version
+    and the change feed recovers the changes from them
+
+    :param op: 'upsert' or 'delete'
+    :param items: Written items
+    :param versions: Catalog version of each item's write
+    """
+    try:
+        change_log.record(op, items, versions)
+    except PyMongoError:
+        app.logger.exception("Could not record the changes of %d items", len(items))
 
 
 @app.delete('/api/v1/items/<item_uuid>')
-@app.doc(responses=[204, 404])
+@app.doc(responses=[204, 503])
 def delete_item(item_uuid):
     """
-    Delete an item by its UUID
+    Delete an item by its UUID. The deletion is recorded before the item is deleted, as there is no item left
+    afterwards to recover it from
     :param item_uuid: UUID of the item to be deleted
     :return: Empty response with status code 204
     """
-    mongo.db.items.delete_one({"item_uuid": item_uuid})
+    try:
+        version = change_log.reserve(1)
+        change_log.record('delete', [{'item_uuid': item_uuid}], [version])
+        mongo.db.items.delete_one(older_than(item_uuid, version))
+    except PyMongoError:
+        abort(503, "Could not delete the item")
+    item_cache.invalidate(item_uuid)
     return '', 204
 
 
@@ -188,10 +636,22 @@ def update_item(item_uuid, data):
         abort(400, "No item_uuid provided")
     try:
         item = Items().load(data)
-        mongo.db.items.replace_one({"item_uuid": item_uuid}, item)
-        return item
+        # Keep the UUID of the item being updated instead of the freshly generated one
+        item['item_uuid'] = item_uuid
+        version = change_log.reserve(1)
+        result = mongo.db.items.replace_one(older_than(item_uuid, version), stored_item(item, version))
     except Exception as e:
         abort(400, str(e.with_traceback(None)))
+    item_cache.invalidate(item_uuid)
+    if result.matched_count:
+        record_changes('upsert', [item], [version])
+        return item
+    # Either a later write got to the item first, which this one is then ordered before, or there is no such item
+    if mongo.db.items.find_one({'item_uuid': item_uuid}, {'_id': 1}) is not None:
+        record_changes('upsert', [item], [version])
+        return item
+    record_changes('delete', [{'item_uuid': item_uuid}], [version])
+    abort(404, "Item not found")
 
 
 @app.post('/api/v1/items')
@@ -206,10 +666,13 @@ def create_item(data):
     """
     try:
         item = Items().load(data)
-        mongo.db.items.insert_one(item)
-        return item, 201
+        version = change_log.reserve(1)
+        mongo.db.items.insert_one(stored_item(item, version))
     except Exception as e:
         abort(400, str(e.with_traceback(None)))
+    item_cache.invalidate(item['item_uuid'])
+    record_changes('upsert', [item], [version])
+    return item, 201
 
 
 @app.post('/api/v1/items/bulk')
@@ -223,11 +686,51 @@ def create_items(data):
     :return: JSON representation of the items along with the status code
     """
     try:
-        items = [Items().load(item) for item in data]
-        mongo.db.items.insert_many(items)
-        return items, 201
+        # data has already been validated against ItemsIn, it only needs UUIDs
+        items = [{**item, 'item_uuid': str(uuid.uuid4())} for item in data]
+        first_version = change_log.reserve(len(items))
+        versions = list(range(first_version, first_version + len(items)))
+        mongo.db.items.insert_many([stored_item(item, version) for item, version in zip(items, versions)])
     except Exception as e:
         abort(400, str(e.with_traceback(None)))
+    item_cache.invalidate(*[item['item_uuid'] for item in items])
+    record_changes('upsert', items, versions)
+    return items, 201
+
+
+def record_import(items, versions):
+    """
+    Invalidate the cache and record the changes for a chunk of imported items
+
+    :param items: Items written by the chunk
+    :param versions: Catalog version of each item's write
+    """
+    item_cache.invalidate(*[item['item_uuid'] for item in items])
+    record_changes('upsert', items, versions)
+
+
+@app.post('/api/v1/items/import')
+@app.output(ImportReportOut)
+@app.doc(responses=[200, 415])
+def import_items():
+    """
+    Import items from a newline-delimited JSON body of any size
+
+    Rows are validated and written in chunks of IMPORT_CHUNK_SIZE. Rows with an item_uuid are upserted on it,
+    so re-running an import is idempotent. Invalid rows are reported by line number without failing the others.
+    :return: Row counts, rejected rows and throughput of the import
+    """
+    if request.mimetype != 'application/x-ndjson':
+        abort(415, "Expected an application/x-ndjson body")
+    return import_ndjson(
+        request.stream,
+        mongo.db.items,
+        ItemsImport(),
+        chunk_size=IMPORT_CHUNK_SIZE,
+        max_errors=MAX_IMPORT_ERRORS,
+        reserve=change_log.reserve,
+        on_write=record_import
+    )
 
 
 if __name__ == '__main__':
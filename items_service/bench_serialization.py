@@ -0,0 +1,79 @@
+"""
+Micro-benchmark of the item list serialization paths
+
+marshmallow: full documents (with _id) dumped through ItemsOut(many=True) and encoded with an ObjectId-aware
+JSON encoder, which is what @app.output does.
+fast: documents read with ITEM_PROJECTION, so they already have the ItemsOut shape, encoded directly with orjson.
+
+Run with: python bench_serialization.py
+"""
+import json
+import random
+import timeit
+import uuid
+
+import orjson
+from apiflask import Schema
+from apiflask.fields import String, Float, UUID
+from bson import ObjectId
+
+
+ROW_COUNTS = [10, 1000, 100000]
+
+
+class ItemsOut(Schema):
+    """
+    Same fields as ItemsOut in app.py
+    """
+    item_uuid = UUID()
+    item_name = String()
+    item_description = String()
+    item_price = Float()
+
+
+class ObjectIdEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        return super().default(obj)
+
+
+def make_documents(count):
+    """
+    Build item documents as they are stored in Mongo
+
+    :param count: Number of documents
+    :return: List of documents
+    """
+    return [{
+        '_id': ObjectId(),
+        'item_uuid': str(uuid.uuid4()),
+        'item_name': f'Item {i}',
+        'item_description': 'A fairly ordinary sentence describing the item.',
+        'item_price': round(random.uniform(1, 100), 2),
+        'search_terms': ['item', str(i)]
+    } for i in range(count)]
+
+
+def marshmallow_path(documents):
+    return json.dumps(ItemsOut(many=True).dump(documents), cls=ObjectIdEncoder).encode()
+
+
+def fast_path(documents):
+    return orjson.dumps(documents)
+
+
+def main():
+    print(f'{"rows":>8} {"marshmallow ms":>15} {"fast ms":>10} {"speedup":>8}')
+    for count in ROW_COUNTS:
+        documents = make_documents(count)
+        projected = [{key: document[key] for key in ItemsOut().fields} for document in documents]
+        assert json.loads(marshmallow_path(documents)) == json.loads(fast_path(projected))
+        number = max(1, 100000 // count)
+        slow = min(timeit.repeat(lambda: marshmallow_path(documents), number=number, repeat=3)) / number
+        fast = min(timeit.repeat(lambda: fast_path(projected), number=number, repeat=3)) / number
+        print(f'{count:>8} {slow * 1000:>15.3f} {fast * 1000:>10.3f} {slow / fast:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
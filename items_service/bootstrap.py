@@ -0,0 +1,59 @@
+"""
+Provision the items database
+
+Creates the indexes the query, search and change feed endpoints rely on and adds the search fields to items that were
+stored before search indexing existed. Run it once per deployment, before the replicas are started, e.g. from a
+one-off items_service container:
+    python bootstrap.py
+Creating an index that already exists is a no-op and only items without search fields are backfilled, so it can be
+run again safely. It prints the time every step took.
+"""
+import argparse
+import time
+
+from pymongo import MongoClient
+
+import search
+from changes import ChangeLog
+
+
+DB_URL = "mongodb://mongo:27017/eCommerceApp"
+
+
+def ensure_item_indexes(collection):
+    """
+    Create the indexes of the listing and lookup endpoints and of the change feed's recovery
+
+    :param collection: The items collection
+    """
+    collection.create_index('item_uuid', unique=True)
+    collection.create_index([('item_price', 1), ('item_uuid', 1)])
+    collection.create_index([('item_name', 1), ('item_uuid', 1)])
+    # Read by the change feed to recover changes that were written but not recorded
+    collection.create_index('catalog_version', sparse=True)
+
+
+def timed(name, step, *args):
+    started = time.perf_counter()
+    result = step(*args)
+    print(f"{name}: done in {time.perf_counter() - started:.2f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Provision the items database')
+    parser.add_argument('--db-url', default=DB_URL, help='Mongo connection string including the database name')
+    parser.add_argument('--skip-backfill', action='store_true', help='only create the indexes')
+    args = parser.parse_args()
+
+    db = MongoClient(args.db_url).get_default_database()
+    timed("item indexes", ensure_item_indexes, db.items)
+    timed("search indexes", search.ensure_search_indexes, db.items)
+    timed("change log indexes", ChangeLog(db).ensure_indexes)
+    if not args.skip_backfill:
+        updated = timed("search fields backfill", search.backfill_index_fields, db.items)
+        print(f"Added search fields to {updated} items")
+
+
+if __name__ == '__main__':
+    main()
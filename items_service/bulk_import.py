@@ -0,0 +1,117 @@
+"""
+Chunked import of newline-delimited JSON items
+
+Rows are read one line at a time, validated once and written in fixed-size unordered bulk writes, so memory use
+depends on the chunk size rather than the size of the upload and one bad row only fails itself. Rows that carry an
+item_uuid are upserted on it, which makes re-running the same file idempotent. Rows without one are inserted with
+a new UUID.
+
+Given a reserve callable, every row is stored with a catalog version reserved for its chunk and only replaces an item
+stored with an older one. A row whose item already has a later version is superseded rather than failed.
+"""
+import json
+import time
+import uuid
+
+from marshmallow import ValidationError
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import search
+
+DUPLICATE_KEY = 11000
+
+
+def _add_error(report, line_number, error, max_errors):
+    report['failed'] += 1
+    if len(report['errors']) < max_errors:
+        report['errors'].append({'line': line_number, 'error': error})
+
+
+def _write_chunk(collection, chunk, report, max_errors, reserve, on_write):
+    """
+    Write one chunk of validated rows
+
+    :param collection: The items collection
+    :param chunk: List of (line number, item) tuples
+    :param report: Import report to be updated
+    :param max_errors: Maximum number of errors kept in the report
+    :param reserve: Optional callable reserving a number of catalog versions and returning the first
+    :param on_write: Optional callback receiving the items written by the chunk and their catalog versions
+    """
+    first_version = reserve(len(chunk)) if reserve else None
+    versions = [first_version + index if reserve else None for index in range(len(chunk))]
+    operations = []
+    for (_, item), version in zip(chunk, versions):
+        document = {**item, **search.index_fields(item)}
+        if version is not None:
+            document['catalog_version'] = version
+        if item.get('item_uuid'):
+            selector = {'item_uuid': item['item_uuid']}
+            if version is not None:
+                selector['catalog_version'] = {'$not': {'$gt': version}}
+            operations.append(UpdateOne(selector, {'$set': document}, upsert=True))
+        else:
+            document['item_uuid'] = item['item_uuid'] = str(uuid.uuid4())
+            operations.append(InsertOne(document))
+    failed = set()
+    superseded = 0
+    try:
+        result = collection.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        for write_error in result['writeErrors']:
+            if reserve and write_error['code'] == DUPLICATE_KEY and chunk[write_error['index']][1].get('item_uuid'):
+                # The item was written with a later version, this row is ordered before that write
+                superseded += 1
+                continue
+            failed.add(write_error['index'])
+            _add_error(report, chunk[write_error['index']][0], write_error['errmsg'], max_errors)
+    report['inserted'] += result['nInserted'] + result['nUpserted']
+    report['updated'] += result['nMatched'] + superseded
+    if on_write:
+        written = [index for index in range(len(chunk)) if index not in failed]
+        on_write([chunk[index][1] for index in written], [versions[index] for index in written])
+
+
+def import_ndjson(lines, collection, schema, chunk_size=1000, max_errors=1000, reserve=None, on_write=None):
+    """
+    Validate and write newline-delimited JSON items in chunks
+
+    :param lines: Iterable of NDJSON lines, as bytes or str
+    :param collection: The items collection
+    :param schema: Schema each row is validated against
+    :param chunk_size: Number of rows per bulk write
+    :param max_errors: Maximum number of per-row errors kept in the report. Further errors are only counted
+    :param reserve: Optional callable reserving a number of catalog versions and returning the first
+    :param on_write: Optional callback receiving the items written by each chunk and their catalog versions
+    :return: Report with row counts, per-row errors and throughput
+    """
+    report = {'received': 0, 'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    started = time.perf_counter()
+    chunk = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        report['received'] += 1
+        try:
+            item = schema.load(json.loads(line))
+        except ValueError as e:
+            _add_error(report, line_number, f'Invalid JSON: {e}', max_errors)
+            continue
+        except ValidationError as e:
+            _add_error(report, line_number, json.dumps(e.messages), max_errors)
+            continue
+        if item.get('item_uuid'):
+            item['item_uuid'] = str(item['item_uuid'])
+        chunk.append((line_number, item))
+        if len(chunk) == chunk_size:
+            _write_chunk(collection, chunk, report, max_errors, reserve, on_write)
+            chunk = []
+    if chunk:
+        _write_chunk(collection, chunk, report, max_errors, reserve, on_write)
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['received'] / elapsed, 1) if elapsed else 0.0
+    return report
@@ -0,0 +1,246 @@
+"""
+Read-through cache for item documents
+
+The first tier is an in-process LRU with a TTL. An optional Redis second tier is shared by all replicas, so an item
+read by one replica is served from Redis by the others. Writes invalidate both tiers. Other replicas' first tiers
+are not notified and may serve a stale item for up to the first-tier TTL, so that TTL should stay short. Items are
+kept in Redis no longer than in process.
+
+A lookup that read an item from Mongo before a write invalidated it must not cache what it read. Every invalidation
+bumps the item's generation, in process and in Redis under item_generation:<item_uuid>. read_through reads the
+generations of the items it loads along with the cache lookup, and only stores the items whose generations have not
+moved since, compared and set atomically in Redis by a Lua script.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+# How long the generation of an invalidated item is kept in Redis, it only has to outlive the lookups in flight
+GENERATION_TTL = 3600
+
+# KEYS: item keys, then their generation keys. ARGV: TTL, then per item its generation as read before it was loaded
+# ('' if it had none) and its JSON. Returns the positions of the stored items
+SET_IF_CURRENT = """
+local count = #KEYS / 2
+local stored = {}
+for index = 1, count do
+    if (redis.call('GET', KEYS[count + index]) or '') == ARGV[2 * index] then
+        redis.call('SET', KEYS[index], ARGV[2 * index + 1], 'EX', ARGV[1])
+        stored[#stored + 1] = index
+    end
+end
+return stored
+"""
+
+
+class ItemCache:
+    """
+    LRU + TTL cache of item documents keyed by item_uuid
+
+    :param max_size: Maximum number of items kept in process
+    :param ttl: Seconds an item is kept in process
+    :param redis_client: Optional Redis client used as the shared second tier
+    :param redis_ttl: Seconds an item is kept in Redis, at most ttl
+    """
+    def __init__(self, max_size=10000, ttl=30, redis_client=None, redis_ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.redis_ttl = min(redis_ttl or ttl, ttl)
+        self._set_if_current = redis_client.register_script(SET_IF_CURRENT) if redis_client is not None else None
+        self._items = OrderedDict()
+        # Sequence of the last invalidation of every recently invalidated key, and the newest one that was forgotten
+        self._sequence = 0
+        self._invalidated = OrderedDict()
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_errors = 0
+
+    @staticmethod
+    def _redis_key(key):
+        return f'item:{key}'
+
+    @staticmethod
+    def _generation_key(key):
+        return f'item_generation:{key}'
+
+    def _get_local(self, key):
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._items[key]
+            self.expirations += 1
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def _set_local(self, key, value):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup(self, keys):
+        """
+        :param keys: item_uuids to be looked up
+        :return: Tuple of the cached items by item_uuid and the read token of the keys that are not cached
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._get_local(key)
+                if value is not None:
+                    found[key] = value
+            self.hits += len(found)
+            token = {'sequence': self._sequence, 'generations': {}}
+        remaining = [key for key in keys if key not in found]
+        if remaining and self.redis_client is not None:
+            try:
+                values = self.redis_client.mget([self._redis_key(key) for key in remaining] +
+                                                [self._generation_key(key) for key in remaining])
+            except redis.RedisError:
+                self.shared_errors += 1
+                values = [None] * (2 * len(remaining))
+            with self._lock:
+                for key, raw, generation in zip(remaining, values, values[len(remaining):]):
+                    if raw is not None:
+                        found[key] = json.loads(raw)
+                        self._set_local(key, found[key])
+                        self.shared_hits += 1
+                    else:
+                        token['generations'][key] = generation.decode() if generation is not None else ''
+        with self._lock:
+            self.misses += len(keys) - len(found)
+        return found, token
+
+    def get_many(self, keys):
+        """
+        Look up several items, first in process and then in Redis
+
+        :param keys: item_uuids to be looked up
+        :return: Dictionary of the cached items by item_uuid. Keys that are not cached are left out
+        """
+        return self._lookup(keys)[0]
+
+    def read_through(self, keys, load):
+        """
+        Look up several items and load the ones that are not cached, caching those not invalidated in the meantime
+
+        :param keys: item_uuids to be looked up
+        :param load: Function loading a list of item_uuids from the database into a dictionary of items by item_uuid
+        :return: Dictionary of the found items by item_uuid
+        """
+        found, token = self._lookup(keys)
+        remaining = [key for key in keys if key not in found]
+        if remaining:
+            loaded = load(remaining)
+            self.set_many(loaded, token)
+            found.update(loaded)
+        return found
+
+    def get(self, key):
+        """
+        Look up a single item
+
+        :param key: item_uuid of the item
+        :return: The cached item, or None if it is not cached
+        """
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items, token=None):
+        """
+        Store items in both tiers
+
+        :param items: Dictionary of items by item_uuid
+        :param token: Read token taken before the items were loaded, items invalidated since then are not stored
+        """
+        if not items:
+            return
+        if token is not None and self.redis_client is not None:
+            keys = list(items)
+            args = [self.redis_ttl]
+            for key in keys:
+                args += [token['generations'].get(key, ''), json.dumps(items[key])]
+            try:
+                stored = self._set_if_current(keys=[self._redis_key(key) for key in keys] +
+                                              [self._generation_key(key) for key in keys], args=args)
+                items = {keys[index - 1]: items[keys[index - 1]] for index in stored}
+            except redis.RedisError:
+                self.shared_errors += 1
+        elif self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for key, value in items.items():
+                    pipeline.set(self._redis_key(key), json.dumps(value), ex=self.redis_ttl)
+                pipeline.execute()
+            except redis.RedisError:
+                self.shared_errors += 1
+        with self._lock:
+            for key, value in items.items():
+                if token is not None and (self._forgotten > token['sequence'] or
+                                          self._invalidated.get(key, 0) > token['sequence']):
+                    continue
+                self._set_local(key, value)
+
+    def set(self, key, value):
+        """
+        Store a single item
+
+        :param key: item_uuid of the item
+        :param value: The item
+        """
+        self.set_many({key: value})
+
+    def invalidate(self, *keys):
+        """
+        Drop items from both tiers and bump their generations
+
+        :param keys: item_uuids of the items that changed
+        """
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+                self._sequence += 1
+                self._invalidated[key] = self._sequence
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_size:
+                self._forgotten = self._invalidated.popitem(last=False)[1]
+        if keys and self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline()
+                pipeline.delete(*[self._redis_key(key) for key in keys])
+                for key in keys:
+                    pipeline.incr(self._generation_key(key))
+                    pipeline.expire(self._generation_key(key), GENERATION_TTL)
+                pipeline.execute()
+            except redis.RedisError:
+                self.shared_errors += 1
+
+    def stats(self):
+        """
+        Counters used to size the cache
+
+        :return: Dictionary of cache statistics
+        """
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'shared_errors': self.shared_errors
+            }
@@ -0,0 +1,190 @@
+"""
+Catalog change log
+
+Every write to the items collection is recorded in the item_changes collection under a monotonic catalog version,
+taken from a counter document. Downstream services keep a local replica of the catalog by loading the export once,
+remembering the catalog version it was taken at, and then applying the changes since that version.
+
+A change log collection is used instead of Mongo change streams because those need a replica set. A write reserves
+its version before it touches the item and stores it on the item as catalog_version, and only replaces an item whose
+catalog_version is older. Concurrent writes of the same item are therefore applied in version order, whatever order
+they reach Mongo in, and the log replays them the same way. Upserts are recorded after the item is written, deletes
+before the item is deleted.
+
+Versions are reserved before their change is written, so a concurrent writer can make version n+1 visible before
+version n. Pages of changes therefore end at the first missing version. A missing version is only given up on once it
+was reserved longer than gap_seconds ago. Items still stored with such a version were written by a writer that died or
+failed before recording the change, and their change is recovered from the item. Other missing versions are skipped.
+Reservation and change times are taken from the Mongo server's clock ($currentDate), never from the replicas'.
+"""
+import datetime
+
+from pymongo import ReturnDocument, UpdateOne
+
+
+class ChangesExpired(Exception):
+    """
+    Changes after the requested version are no longer retained
+    """
+
+
+class ChangeLog:
+    """
+    Records item changes and serves them by catalog version
+
+    :param db: Mongo database holding the items
+    :param retention_seconds: How long changes are kept. Consumers that fall further behind have to resync
+    :param gap_seconds: How long a reserved version may stay missing before it is skipped
+    """
+    def __init__(self, db, retention_seconds=7 * 24 * 3600, gap_seconds=30):
+        self.db = db
+        self.changes = db.item_changes
+        self.items = db.items
+        self.counters = db.counters
+        self.retention_seconds = retention_seconds
+        self.gap_seconds = gap_seconds
+
+    def ensure_indexes(self):
+        """
+        Create the version index and the TTL index that trims old changes
+        """
+        self.changes.create_index('version', unique=True)
+        self.changes.create_index('changed_at', expireAfterSeconds=self.retention_seconds)
+
+    def reserve(self, count):
+        """
+        Reserve consecutive catalog versions for changes about to be written
+
+        :param count: Number of versions
+        :return: The first of the versions
+        """
+        counter = self.counters.find_one_and_update(
+            {'_id': 'catalog_version'},
+            {'$inc': {'value': count}, '$currentDate': {'reserved_at': True}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['value'] - count + 1
+
+    def record(self, op, items, versions):
+        """
+        Record a change to one or more items under the versions reserved for them
+
+        :param op: 'upsert' or 'delete'
+        :param items: Changed items. Items of a delete only need an item_uuid
+        :param versions: Catalog version of each item's change
+        """
+        if not items:
+            return
+        self.changes.bulk_write([UpdateOne(
+            {'version': version},
+            {
+                '$set': {'op': op, 'item_uuid': item['item_uuid'], 'item': item if op == 'upsert' else None},
+                '$currentDate': {'changed_at': True}
+            },
+            upsert=True
+        ) for version, item in zip(versions, items)], ordered=False)
+
+    def _recover(self, after, before, projection):
+        """
+        Record the changes of items written under versions that are missing from the log
+
+        :param after: Last version before the missing ones
+        :param before: First version after the missing ones
+        :param projection: Fields of the items that make up their change
+        :return: The recovered changes, oldest first
+        """
+        items = list(self.items.find({'catalog_version': {'$gt': after, '$lt': before}},
+                                     {**projection, 'catalog_version': 1}))
+        if not items:
+            return []
+        items.sort(key=lambda item: item['catalog_version'])
+        versions = [item.pop('catalog_version') for item in items]
+        self.record('upsert', items, versions)
+        return [{'version': version, 'op': 'upsert', 'item_uuid': item['item_uuid'], 'item': item}
+                for version, item in zip(versions, items)]
+
+    def current_version(self):
+        """
+        :return: Catalog version of the latest change, 0 if nothing was ever recorded
+        """
+        counter = self.counters.find_one({'_id': 'catalog_version'})
+        return counter['value'] if counter else 0
+
+    def oldest_version(self):
+        """
+        :return: Catalog version of the oldest retained change, or None if no change is retained
+        """
+        oldest = self.changes.find_one({}, {'version': 1}, sort=[('version', 1)])
+        return oldest['version'] if oldest else None
+
+    def server_time(self):
+        """
+        :return: Current time of the Mongo server, naive UTC like the stored dates
+        """
+        return self.db.command('hello')['localTime']
+
+    def _gap_expired(self, reserved_before):
+        """
+        :param reserved_before: Time by which the missing versions had been reserved, None if unknown
+        :return: Whether the missing versions have been reserved longer than gap_seconds
+        """
+        if reserved_before is None:
+            return True
+        return self.server_time() - reserved_before > datetime.timedelta(seconds=self.gap_seconds)
+
+    def since(self, version, limit, projection):
+        """
+        Get the changes after a catalog version, up to the first version that is still being written
+
+        Raises ChangesExpired if the versions right after `version` are missing and cannot be in flight anymore,
+        while no change up to `version` is retained either, i.e. they were trimmed
+        :param version: Last catalog version the consumer has applied
+        :param limit: Maximum number of changes
+        :param projection: Fields of an item that make up its change, used to recover changes that were not recorded
+        :return: Dictionary of the changes, oldest first, the version to continue from and whether more changes are
+            available right away
+        """
+        changes = list(self.changes.find(
+            {'version': {'$gt': version}},
+            {'_id': 0, 'changed_at': 1, 'version': 1, 'op': 1, 'item_uuid': 1, 'item': 1}
+        ).sort('version', 1).limit(limit))
+        page = []
+        last_version = version
+        for change in changes:
+            # Versions are reserved in order, so the missing ones were reserved before this change was written
+            if change['version'] != last_version + 1:
+                if not self._skip_gap(version, last_version, change['changed_at']):
+                    break
+                page.extend(self._recover(last_version, change['version'], projection))
+            change.pop('changed_at')
+            page.append(change)
+            last_version = change['version']
+        else:
+            if len(changes) < limit:
+                # Versions reserved after the last change. If even the latest reservation is too old to be in flight,
+                # they were all abandoned
+                counter = self.counters.find_one({'_id': 'catalog_version'}) or {'value': 0}
+                reserved_at = counter.get('reserved_at')
+                if last_version < counter['value'] and self._skip_gap(version, last_version, reserved_at):
+                    page.extend(self._recover(last_version, counter['value'] + 1, projection))
+                    last_version = counter['value']
+        return {'changes': page, 'version': last_version, 'has_more': len(page) >= limit}
+
+    def _skip_gap(self, version, last_version, reserved_before):
+        """
+        Decide whether to skip the versions missing after last_version
+
+        :param version: Version the consumer asked for changes after
+        :param last_version: Last version before the gap
+        :param reserved_before: Time by which the missing versions had been reserved
+        :return: Whether the gap is skipped, False if its versions may still be written
+        """
+        if not self._gap_expired(reserved_before):
+            return False
+        if last_version == version:
+            oldest = self.oldest_version()
+            if oldest is None or oldest > version:
+                # Nothing up to the consumer's version is retained, the missing changes may have been trimmed
+                raise ChangesExpired(version)
+        return True
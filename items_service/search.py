@@ -0,0 +1,125 @@
+"""
+Search support for the items collection
+
+Full-text queries go through a weighted Mongo text index over item_name and item_description, so they are answered
+from the index and ranked by relevance. Prefix and autocomplete queries go through search_terms, a lower-cased list
+of the words in item_name that is stored on every item and covered by a multikey index, so an anchored prefix is an
+index range scan instead of a collection scan.
+"""
+import re
+
+from pymongo import TEXT, UpdateOne
+
+
+TEXT_INDEX_NAME = 'items_text'
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """
+    Split text into lower-case words
+
+    :param text: Text to be split
+    :return: List of words
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def index_fields(item):
+    """
+    Build the search fields that have to be stored alongside an item
+
+    :param item: Item with at least an item_name
+    :return: Dictionary of fields to be merged into the item document
+    """
+    return {'search_terms': sorted(set(tokenize(item['item_name'])))}
+
+
+def ensure_search_indexes(collection):
+    """
+    Create the text and prefix indexes used by search
+
+    :param collection: The items collection
+    """
+    collection.create_index(
+        [('item_name', TEXT), ('item_description', TEXT)],
+        name=TEXT_INDEX_NAME,
+        weights={'item_name': 10, 'item_description': 1}
+    )
+    collection.create_index([('search_terms', 1), ('item_price', 1), ('item_uuid', 1)])
+
+
+def backfill_index_fields(collection, batch_size=1000):
+    """
+    Add the search fields to items that were stored before search indexing existed
+
+    :param collection: The items collection
+    :param batch_size: Number of updates sent per bulk write
+    :return: Number of items updated
+    """
+    updated = 0
+    requests = []
+    for item in collection.find({'search_terms': {'$exists': False}}, {'item_name': 1}):
+        requests.append(UpdateOne({'_id': item['_id']}, {'$set': index_fields(item)}))
+        if len(requests) == batch_size:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += collection.bulk_write(requests, ordered=False).modified_count
+    return updated
+
+
+def text_query(term):
+    """
+    Build a full-text query over item names and descriptions
+
+    :param term: Words to search for
+    :return: Mongo query
+    """
+    return {'$text': {'$search': term}}
+
+
+def text_search(collection, term, offset, limit, projection=None, criteria=None):
+    """
+    Full-text search over item names and descriptions, best matches first
+
+    :param collection: The items collection
+    :param term: Words to search for
+    :param offset: Number of results to skip
+    :param limit: Maximum number of results
+    :param projection: Optional Mongo projection. The text score is used for sorting without being projected
+    :param criteria: Optional additional Mongo query the items have to match
+    :return: Cursor over the matching items
+    """
+    return collection.find({**(criteria or {}), **text_query(term)}, projection) \
+        .sort([('score', {'$meta': 'textScore'}), ('item_uuid', 1)]).skip(offset).limit(limit)
+
+
+def prefix_query(term):
+    """
+    Build a query matching items that have a name word starting with each word of the term
+
+    :param term: Words typed so far
+    :return: Mongo query, or None if the term contains no words
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return None
+    return {'$and': [{'search_terms': {'$regex': '^' + re.escape(token)}} for token in tokens]}
+
+
+def prefix_search(collection, term, offset, limit, projection=None):
+    """
+    Prefix search over item name words, ordered by name
+
+    :param collection: The items collection
+    :param term: Words typed so far
+    :param offset: Number of results to skip
+    :param limit: Maximum number of results
+    :param projection: Optional Mongo projection
+    :return: Cursor over the matching items, or an empty list if the term contains no words
+    """
+    query = prefix_query(term)
+    if query is None:
+        return []
+    return collection.find(query, projection).sort([('item_name', 1), ('item_uuid', 1)]).skip(offset).limit(limit)
@@ -0,0 +1,106 @@
+"""
+Seed the items collection with generated catalog data
+
+Items are generated in chunks across a process pool. Every chunk is generated from its own seed, derived from the
+run seed and the chunk index, so the same arguments always produce the same items with the same UUIDs. Each chunk is
+written as one unordered bulk write of upserts on item_uuid, which makes re-running the command idempotent.
+
+Usage: python seed.py --count 1000000 --workers 8
+"""
+import argparse
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from faker import Faker
+from pymongo import MongoClient, UpdateOne
+
+import search
+
+
+DB_URL = "mongodb://mongo:27017/eCommerceApp"
+
+collection = None
+
+
+def connect(db_url):
+    """
+    Open the worker process's connection to the items collection
+
+    :param db_url: Mongo connection string including the database name
+    """
+    global collection
+    collection = MongoClient(db_url).get_default_database().items
+
+
+def generate_items(seed, chunk_index, chunk_size, count):
+    """
+    Deterministically generate one chunk of items
+
+    :param seed: Seed of the whole run
+    :param chunk_index: Index of the chunk
+    :param chunk_size: Number of items per chunk
+    :param count: Total number of items of the run
+    :return: List of items
+    """
+    chunk_seed = seed * 1000003 + chunk_index
+    fake = Faker()
+    fake.seed_instance(chunk_seed)
+    rng = random.Random(chunk_seed)
+    items = []
+    for _ in range(min(chunk_size, count - chunk_index * chunk_size)):
+        item = {
+            'item_uuid': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'item_name': fake.catch_phrase(),
+            'item_description': fake.sentence(),
+            'item_price': round(rng.uniform(1, 100), 2)
+        }
+        item.update(search.index_fields(item))
+        items.append(item)
+    return items
+
+
+def seed_chunk(seed, chunk_index, chunk_size, count):
+    """
+    Generate one chunk of items and upsert it on item_uuid
+
+    :return: Tuple of the number of inserted and updated items
+    """
+    items = generate_items(seed, chunk_index, chunk_size, count)
+    result = collection.bulk_write(
+        [UpdateOne({'item_uuid': item['item_uuid']}, {'$set': item}, upsert=True) for item in items],
+        ordered=False
+    )
+    return result.upserted_count, result.matched_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed the items collection with generated items')
+    parser.add_argument('--count', type=int, default=100, help='number of items to generate')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='number of items per bulk write')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the run, the same seed gives the same items')
+    parser.add_argument('--db-url', default=DB_URL, help='Mongo connection string including the database name')
+    args = parser.parse_args()
+
+    connect(args.db_url)
+    collection.create_index('item_uuid', unique=True)
+
+    chunks = range((args.count + args.chunk_size - 1) // args.chunk_size)
+    inserted = updated = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=connect, initargs=(args.db_url,)) as executor:
+        futures = [executor.submit(seed_chunk, args.seed, chunk_index, args.chunk_size, args.count)
+                   for chunk_index in chunks]
+        for future in futures:
+            chunk_inserted, chunk_updated = future.result()
+            inserted += chunk_inserted
+            updated += chunk_updated
+    elapsed = time.perf_counter() - started
+    print(f"Seeded {args.count} items in {elapsed:.1f}s ({args.count / elapsed:.0f} rows/sec): "
+          f"{inserted} inserted, {updated} already present")
+
+
+if __name__ == '__main__':
+    main()
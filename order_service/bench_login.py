@@ -0,0 +1,85 @@
+"""
+Benchmark of logins under mixed traffic
+
+Runs logins and authenticated GET /api/v1/users/ requests side by side against a running order_service and prints,
+for each kind, the requests per second, the p50 and p99 latency and the number of 503 responses. The reads show how
+much a login burst slows down the rest of the API.
+
+Run with: python bench_login.py --url http://localhost:5002 --login-clients 16 --read-clients 16
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+
+import requests
+
+
+def run_client(send, deadline, results):
+    """
+    Send requests one after another until the deadline, waiting as asked by the Retry-After header of 503 responses
+
+    :param send: Function sending one request and returning the response
+    :param deadline: perf_counter value at which to stop
+    :param results: List the latency and status code of each request are appended to
+    """
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = send()
+        results.append((time.perf_counter() - started, response.status_code))
+        if response.status_code == 503:
+            time.sleep(float(response.headers.get('Retry-After', 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure login throughput and latency under mixed traffic')
+    parser.add_argument('--url', default='http://localhost:5002', help='order_service base URL')
+    parser.add_argument('--login-clients', type=int, default=16, help='concurrent clients logging in')
+    parser.add_argument('--read-clients', type=int, default=16, help='concurrent clients reading the user')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run for')
+    args = parser.parse_args()
+
+    user = {
+        'first_name': 'Bench', 'last_name': 'User', 'email': f'bench-{uuid.uuid4().hex[:8]}@example.com',
+        'password': 'bench-password', 'shipping_address': '1 Bench Street'
+    }
+    requests.post(f'{args.url}/api/v1/users/', json=user).raise_for_status()
+    credentials = {'email': user['email'], 'password': user['password']}
+    login = requests.post(f'{args.url}/api/v1/users/login', json=credentials)
+    login.raise_for_status()
+    headers = {'Authorization': f"Bearer {login.json()['token']}"}
+
+    results = {'login': [], 'read': []}
+    deadline = time.perf_counter() + args.duration
+    threads = []
+    for kind, clients in (('login', args.login_clients), ('read', args.read_clients)):
+        for _ in range(clients):
+            session = requests.Session()
+            if kind == 'login':
+                def send(session=session):
+                    return session.post(f'{args.url}/api/v1/users/login', json=credentials)
+            else:
+                def send(session=session):
+                    return session.get(f'{args.url}/api/v1/users/', headers=headers)
+            threads.append(threading.Thread(target=run_client, args=(send, deadline, results[kind])))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"{'requests':<10}{'req/s':>8}{'ok/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'503s':>7}")
+    for kind, samples in results.items():
+        if len(samples) < 2:
+            print(f"{kind:<10}{'too few requests':>41}")
+            continue
+        latencies = [latency for latency, _ in samples]
+        ok = sum(1 for _, status_code in samples if status_code == 200)
+        shed = sum(1 for _, status_code in samples if status_code == 503)
+        percentiles = statistics.quantiles(latencies, n=100)
+        print(f"{kind:<10}{len(samples) / args.duration:>8.1f}{ok / args.duration:>8.1f}"
+              f"{percentiles[49] * 1000:>9.1f}{percentiles[98] * 1000:>9.1f}{shed:>7}")
+
+
+if __name__ == '__main__':
+    main()
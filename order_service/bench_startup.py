@@ -0,0 +1,61 @@
+"""
+Measure how long an order_service replica takes to start
+
+Starts app.py the way the container does, polls it until it answers and prints the time to the first response. With
+WARM_UP_VIEWS=1 in the environment this includes building the view indexes.
+
+Run with: python bench_startup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+PORT = 5002
+
+
+def time_startup(timeout):
+    """
+    :param timeout: Seconds to wait for the replica to answer
+    :return: Seconds from starting the process to its first response, or None if it did not answer in time
+    """
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                return None
+            try:
+                requests.get(f'http://localhost:{PORT}/openapi.json', timeout=1)
+                return time.perf_counter() - started
+            except requests.ConnectionError:
+                time.sleep(0.01)
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time of order_service')
+    parser.add_argument('--runs', type=int, default=5, help='number of times the app is started')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for each start')
+    args = parser.parse_args()
+
+    timings = []
+    for run in range(args.runs):
+        seconds = time_startup(args.timeout)
+        print(f"run {run + 1}: " + (f"{seconds:.2f}s" if seconds is not None else "did not start"))
+        if seconds is not None:
+            timings.append(seconds)
+    if timings:
+        print(f"median {statistics.median(timings):.2f}s, max {max(timings):.2f}s")
+
+
+if __name__ == '__main__':
+    main()
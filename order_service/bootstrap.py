@@ -0,0 +1,39 @@
+"""
+Provision the orderservice database
+
+Creates the database if needed, saves the design documents that are missing and migrates the ones that are out of
+date. Run it once per deployment, before the replicas are started, e.g. from a one-off order_service container:
+    python bootstrap.py --warm-up
+With --warm-up the view indexes are built as well, so the replicas do not build them on their first requests.
+
+It prints the time each new index took to build and the size of the data and of every index before and after.
+"""
+import argparse
+import time
+
+from database import create_database, data_size, index_sizes, provision, warm_up
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Provision the orderservice database')
+    parser.add_argument('--warm-up', action='store_true', help='build the view indexes once provisioned')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    database = create_database()
+    sizes_before = index_sizes(database)
+    for design_doc_id, (action, seconds) in provision(database).items():
+        print(f"{design_doc_id}: {action}" + (f", index built in {seconds:.2f}s" if seconds is not None else ""))
+    print(f"Provisioned in {time.perf_counter() - started:.2f}s")
+    if args.warm_up:
+        for design_doc_id, seconds in warm_up(database).items():
+            print(f"{design_doc_id}: index built in {seconds:.2f}s")
+
+    print(f"Data: {data_size(database)} bytes")
+    for design_doc_id, size in index_sizes(database).items():
+        before = sizes_before.get(design_doc_id)
+        print(f"{design_doc_id} index: " + (f"{before} -> " if before is not None else "") + f"{size} bytes")
+
+
+if __name__ == '__main__':
+    main()
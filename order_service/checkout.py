@@ -0,0 +1,271 @@
+"""
+Checkout: turning a basket into an order
+
+A checkout makes the same few round trips whatever the size of the basket:
+
+1. read the order's id from CouchDB, to answer a retried checkout with the order it already created,
+2. read the basket's lines from basket_service,
+3. look up the price of every item with one items_service batch call,
+4. write the order and one document per line with one _bulk_docs call,
+5. remove the ordered units from the basket, leaving lines added since step 2.
+
+The order's id is derived from the user and the Idempotency-Key of the request, and the ids of its lines from the
+order's. A retry, or a concurrent duplicate that gets past step 1, therefore conflicts on write instead of creating a
+second order, and is answered with the order that was created first.
+
+_bulk_docs is not atomic, so the order can be saved without some of its lines. The order keeps what was ordered in
+line_items, and a retry writes the lines that are missing before answering. basket_service removes the units of an
+order only once, so a retry can safely remove them again in case the first call stopped before step 5.
+"""
+import datetime
+import logging
+import uuid
+
+import requests
+from couchdb.http import ResourceConflict
+from requests.adapters import HTTPAdapter
+
+from database import couchdb_errors
+
+# Namespace of the order UUIDs derived from a user and an idempotency key
+ORDER_NAMESPACE = uuid.UUID('0b7f5f2e-55d4-4c55-9b8c-2f1d3c6a9e41')
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(Exception):
+    """
+    Checkout that cannot go ahead
+
+    :param status_code: HTTP status code to answer with
+    :param message: Error message
+    :param detail: Error details
+    """
+    def __init__(self, status_code, message, detail=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.detail = detail or {}
+
+
+def create_session(pool_size=32):
+    """
+    Create a requests session that keeps connections to basket_service and items_service alive
+
+    :param pool_size: Maximum number of pooled connections per service
+    :return: The session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def order_doc_id(order_uuid):
+    return f'order:{order_uuid}'
+
+
+def line_doc_id(order_uuid, item_uuid):
+    return f'order:{order_uuid}:line:{item_uuid}'
+
+
+def make_line(order, item_uuid, line_item):
+    """
+    :param order: Order document
+    :param item_uuid: Unique identifier for the item
+    :param line_item: The item's quantity, unit price and name, as kept in the order's line_items
+    :return: The document of the order's line of the item
+    """
+    return {
+        '_id': line_doc_id(order['order_uuid'], item_uuid),
+        'type': 'order_line',
+        'order_uuid': order['order_uuid'],
+        'user_uuid': order['user_uuid'],
+        'item_uuid': item_uuid,
+        'item_name': line_item['item_name'],
+        'unit_price': line_item['unit_price'],
+        'quantity': line_item['quantity'],
+        'line_total': round(line_item['unit_price'] * line_item['quantity'], 2),
+        'created_at': order['created_at']
+    }
+
+
+def load_order(database, order_uuid):
+    """
+    Get an order and its lines with one _all_docs range read, the order's id sorting before its lines'
+
+    :param database: The database
+    :param order_uuid: Unique identifier for the order
+    :return: The order document with its line documents under 'lines', or None if there is no such order
+    """
+    rows = database.view('_all_docs', startkey=order_doc_id(order_uuid),
+                         endkey=line_doc_id(order_uuid, '\ufff0'), include_docs=True)
+    docs = [row.doc for row in rows if row.doc is not None]
+    if not docs or docs[0]['_id'] != order_doc_id(order_uuid):
+        return None
+    order = dict(docs[0])
+    order['lines'] = [dict(doc) for doc in docs[1:]]
+    return order
+
+
+class Checkout:
+    """
+    Checkout pipeline
+
+    :param database: The orderservice database
+    :param session: requests session used to call basket_service and items_service
+    :param basket_service_url: URL of the basket_service baskets, ending with a slash
+    :param items_batch_url: URL of the items_service batch lookup endpoint
+    :param timeout: (connect, read) timeout of calls to the other services, in seconds
+    """
+    def __init__(self, database, session, basket_service_url, items_batch_url, timeout=(0.5, 2)):
+        self.database = database
+        self.session = session
+        self.basket_service_url = basket_service_url
+        self.items_batch_url = items_batch_url
+        self.timeout = timeout
+
+    def _get_basket(self, basket_id):
+        """
+        :param basket_id: Unique identifier for the basket
+        :return: Dictionary of item_uuid to quantity
+        """
+        try:
+            response = self.session.get(f'{self.basket_service_url}{basket_id}', timeout=self.timeout)
+            if response.status_code == 404:
+                raise CheckoutError(404, "Basket not found")
+            response.raise_for_status()
+        except requests.RequestException:
+            raise CheckoutError(503, "Could not reach the basket service")
+        return {line['item_uuid']: line['quantity'] for line in response.json()}
+
+    def _get_items(self, item_uuids):
+        """
+        :param item_uuids: UUIDs of the items, at most as many as items_service looks up at once
+        :return: Dictionary of the found items by item_uuid
+        """
+        try:
+            response = self.session.get(self.items_batch_url, params=[('id', item_uuid) for item_uuid in item_uuids],
+                                        timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            raise CheckoutError(503, "Could not reach the items service")
+        return {item['item_uuid']: item for item in response.json()['items']}
+
+    def _remove_from_basket(self, order):
+        """
+        Remove the ordered units from the order's basket, once per order however often it is called
+
+        :param order: Order document
+        """
+        lines = [{'item_uuid': item_uuid, 'quantity': line_item['quantity']}
+                 for item_uuid, line_item in order['line_items'].items()]
+        try:
+            self.session.post(f"{self.basket_service_url}{order['basket_id']}/remove_items",
+                              json={'items': lines, 'checkout_id': order['order_uuid']},
+                              timeout=self.timeout).raise_for_status()
+        except requests.RequestException:
+            logger.exception("Could not remove the lines of order %s from basket %s", order['order_uuid'],
+                             order['basket_id'])
+
+    def _save_lines(self, order, lines):
+        """
+        :param order: Order document, already saved
+        :param lines: Line documents of the order to save
+        """
+        # A line that conflicts was written by a concurrent call for the same order, from the same line_items
+        failed = [docid for succeeded, docid, result in self.database.update(lines)
+                  if not succeeded and not isinstance(result, ResourceConflict)]
+        if failed:
+            logger.error("Could not save lines %s of order %s", failed, order['order_uuid'])
+            raise CheckoutError(503, "Could not save the order")
+
+    def checkout(self, user_uuid, basket_id, idempotency_key):
+        """
+        Create an order from the lines of a basket, at the items' current prices, and empty the basket
+
+        :param user_uuid: Unique identifier for the user checking out
+        :param basket_id: Unique identifier for the basket
+        :param idempotency_key: Key the client sends again when it retries the checkout
+        :return: Tuple of the order, with its lines, and whether it was created by this call
+        """
+        try:
+            return self._checkout(user_uuid, basket_id, idempotency_key)
+        except couchdb_errors:
+            logger.exception("Could not reach CouchDB to check out basket %s", basket_id)
+            raise CheckoutError(503, "Could not reach the order database")
+
+    def _checkout(self, user_uuid, basket_id, idempotency_key):
+        order_uuid = str(uuid.uuid5(ORDER_NAMESPACE, f'{user_uuid}:{idempotency_key}'))
+        existing = self.database.get(order_doc_id(order_uuid))
+        if existing is not None:
+            return self._replay(order_uuid, basket_id), False
+
+        quantities = self._get_basket(basket_id)
+        if not quantities:
+            raise CheckoutError(422, "Basket is empty")
+        items = self._get_items(list(quantities))
+        missing = [item_uuid for item_uuid in quantities if item_uuid not in items]
+        if missing:
+            raise CheckoutError(409, "Some items are no longer available", {'missing': missing})
+
+        order = {
+            '_id': order_doc_id(order_uuid),
+            'type': 'order',
+            'order_uuid': order_uuid,
+            'user_uuid': user_uuid,
+            'basket_id': basket_id,
+            'idempotency_key': idempotency_key,
+            'created_at': datetime.datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+            'line_items': {item_uuid: {
+                'quantity': quantity,
+                'unit_price': items[item_uuid]['item_price'],
+                'item_name': items[item_uuid]['item_name']
+            } for item_uuid, quantity in quantities.items()},
+            'item_count': sum(quantities.values()),
+            'is_paid': False
+        }
+        lines = [make_line(order, item_uuid, line_item) for item_uuid, line_item in order['line_items'].items()]
+        order['total_cost'] = round(sum(line['line_total'] for line in lines), 2)
+
+        results = self.database.update([order] + lines)
+        succeeded, _, order_result = results[0]
+        if not succeeded:
+            if isinstance(order_result, ResourceConflict):
+                # A concurrent duplicate created the order first
+                return self._replay(order_uuid, basket_id), False
+            raise CheckoutError(503, "Could not save the order")
+        failed = [line for line, (succeeded, _, result) in zip(lines, results[1:])
+                  if not succeeded and not isinstance(result, ResourceConflict)]
+        if failed:
+            # Written by the retry, which finds the order without them
+            self._save_lines(order, failed)
+
+        self._remove_from_basket(order)
+        order['lines'] = lines
+        return order, True
+
+    def _replay(self, order_uuid, basket_id):
+        """
+        :param order_uuid: Unique identifier for the order created by an earlier call with the same key
+        :param basket_id: Basket of the retried call
+        :return: The order, if it was created from the same basket, with any lines the earlier call did not save
+        """
+        order = load_order(self.database, order_uuid)
+        if order is None:
+            # Deleted since the earlier call created it
+            raise CheckoutError(409, "Idempotency key already used for an order that was deleted")
+        if order['basket_id'] != basket_id:
+            raise CheckoutError(409, "Idempotency key already used for another basket")
+        if 'line_items' not in order:
+            # Created before orders kept their line_items, and answered only once it was complete
+            return order
+        saved = {line['item_uuid'] for line in order['lines']}
+        missing = [make_line(order, item_uuid, line_item) for item_uuid, line_item in order['line_items'].items()
+                   if item_uuid not in saved]
+        if missing:
+            self._save_lines(order, missing)
+            order['lines'] = sorted(order['lines'] + missing, key=lambda line: line['_id'])
+        self._remove_from_basket(order)
+        return order
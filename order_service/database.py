@@ -0,0 +1,205 @@
+"""
+CouchDB access for order_service
+
+Nothing here talks to CouchDB at import time. get_database connects on first use, so the app starts, and its module
+can be imported, whether or not CouchDB is reachable.
+
+The design documents are provisioned by bootstrap.py rather than by every replica. Each one carries a version, and
+provisioning only writes a design document that is missing or older than the one defined here, so running it again is
+a no-op. Changing a view means changing its design document and bumping its version.
+
+The views emit their key and no value. Lookups read the documents with include_docs, so the indexes do not hold a
+copy of every user and payment method, password hashes and card data included.
+
+An older design document is migrated without downtime. The new version is first saved under a staging id and its
+index is built while the old one keeps serving. It is then copied over the old design document. CouchDB finds the
+index by the view definitions, so the new design document takes over the index that was just built. The old index
+files are then cleaned up.
+"""
+import http.client
+import threading
+import time
+
+import couchdb
+
+from settings import couchdb_url, db_name
+
+STAGING_SUFFIX = '_staging'
+
+# Errors of an unreachable or failing CouchDB, as opposed to a missing document
+couchdb_errors = (couchdb.http.HTTPError, http.client.HTTPException, OSError)
+
+payment_method_design_doc = {
+    "_id": "_design/payment_method",
+    "version": 2,
+    "views": {
+        "payment_method_by_uuid": {
+            "map": "function(doc) { if (doc.type === 'payment_method') { emit(doc.payment_uuid, null); } }"
+        },
+        "payment_methods_by_user_uuid": {
+            "map": "function(doc) { if (doc.type === 'payment_method') { emit(doc.user_uuid, null); } }"
+        }
+    },
+    "language": "javascript"
+}
+
+user_design_doc = {
+    "_id": "_design/user",
+    "version": 2,
+    "views": {
+        "user_by_email": {
+            "map": "function(doc) { if (doc.type === 'user') { emit(doc.email, null); } }"
+        },
+        "user_by_uuid": {
+            "map": "function(doc) { if (doc.type === 'user') { emit(doc.user_uuid, null); } }"
+        }
+    },
+    "language": "javascript"
+}
+
+# A user's orders by date, with their total_cost reduced to the count, sum, min and max of the user's orders
+order_design_doc = {
+    "_id": "_design/order",
+    "version": 1,
+    "views": {
+        "orders_by_user": {
+            "map": "function(doc) { if (doc.type === 'order') { "
+                   "emit([doc.user_uuid, doc.created_at], doc.total_cost); } }",
+            "reduce": "_stats"
+        }
+    },
+    "language": "javascript"
+}
+
+design_docs = [payment_method_design_doc, user_design_doc, order_design_doc]
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database():
+    """
+    Get the orderservice database, connecting on first use
+    :return: The database
+    """
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = couchdb.Server(couchdb_url)[db_name]
+    return _database
+
+
+def create_database():
+    """
+    Create the orderservice database if it does not exist
+    :return: The database
+    """
+    server = couchdb.Server(couchdb_url)
+    if db_name not in server:
+        server.create(db_name)
+    return server[db_name]
+
+
+def find_document(database, view, key, **options):
+    """
+    Get the document of the first row of a view with the given key
+    :param database: The database
+    :param view: Path of the view, e.g. _design/user/_view/user_by_uuid
+    :param key: Key to look up
+    :param options: Further query options, e.g. update='lazy' to read the index as it is and update it afterwards
+    :return: The document, or None if there is none
+    """
+    for row in database.view(view, key=key, include_docs=True, **options):
+        # A row of a lazily read index may point to a document deleted since
+        if row.doc is not None:
+            return row.doc
+
+
+def build_index(database, design_doc_id):
+    """
+    Build the index of a design document. All views of a design document share one index, so one query builds them
+    all
+    :param database: The database
+    :param design_doc_id: Id of the design document
+    :return: Seconds the index took to build
+    """
+    design_doc = database[design_doc_id]
+    view = next(iter(design_doc['views']))
+    started = time.perf_counter()
+    len(database.view(f"{design_doc_id}/_view/{view}", limit=0))
+    return time.perf_counter() - started
+
+
+def index_sizes(database):
+    """
+    :param database: The database
+    :return: Dictionary of design document id to the size of its index on disk in bytes, for the stored design
+    documents
+    """
+    sizes = {}
+    for design_doc in design_docs:
+        if design_doc['_id'] in database:
+            view_index = database.info(design_doc['_id'][len('_design/'):])['view_index']
+            sizes[design_doc['_id']] = view_index['sizes']['file'] if 'sizes' in view_index else view_index['disk_size']
+    return sizes
+
+
+def data_size(database):
+    """
+    :param database: The database
+    :return: Size of the database's documents on disk in bytes
+    """
+    info = database.info()
+    return info['sizes']['file'] if 'sizes' in info else info['disk_size']
+
+
+def migrate(database, design_doc, stored):
+    """
+    Replace a design document with a new version without taking its views offline
+    :param database: The database
+    :param design_doc: New version of the design document
+    :param stored: The stored design document
+    :return: Seconds the new index took to build
+    """
+    staging_id = design_doc['_id'] + STAGING_SUFFIX
+    staging = dict(design_doc, _id=staging_id)
+    left_over = database.get(staging_id)
+    if left_over is not None:
+        # From an interrupted migration
+        staging['_rev'] = left_over['_rev']
+    database.save(staging)
+    seconds = build_index(database, staging_id)
+    database.copy(staging_id, dict(stored))
+    database.delete(database[staging_id])
+    database.cleanup()
+    return seconds
+
+
+def provision(database):
+    """
+    Save the design documents that are missing and migrate the ones older than defined here
+    :param database: The database
+    :return: Dictionary of design document id to 'created', 'migrated' or 'current' and, for migrated ones, the
+    seconds their new index took to build
+    """
+    report = {}
+    for design_doc in design_docs:
+        stored = database.get(design_doc['_id'])
+        if stored is None:
+            database.save(dict(design_doc))
+            report[design_doc['_id']] = 'created', None
+        elif stored.get('version', 0) < design_doc['version']:
+            report[design_doc['_id']] = 'migrated', migrate(database, design_doc, stored)
+        else:
+            report[design_doc['_id']] = 'current', None
+    return report
+
+
+def warm_up(database):
+    """
+    Build the view indexes so that the first requests do not wait for them
+    :param database: The database
+    :return: Dictionary of design document id to the seconds its index took to build
+    """
+    return {design_doc['_id']: build_index(database, design_doc['_id']) for design_doc in design_docs}
@@ -0,0 +1,78 @@
+"""
+Order history of a user
+
+The orders_by_user view of _design/order is keyed [user_uuid, created_at], so a user's orders are one contiguous key
+range sorted by date, and its _stats reduce keeps the count, sum, min and max of their total_cost in the B-tree. A page
+of history and the user's totals are read with one request to the view's /queries endpoint, which runs both queries:
+the rows of the page, starting at the cursor's key and document id, and the reduced totals of the whole range. Both
+are B-tree lookups, so a page costs the same for a user with thousands of orders as for a user with a few.
+"""
+import base64
+import binascii
+import json
+
+ORDER_HISTORY_VIEW = ('_design', 'order', '_view', 'orders_by_user')
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(row):
+    """
+    Build an opaque pagination cursor pointing at the given row
+
+    :param row: First row of the next page
+    :return: URL-safe cursor string
+    """
+    payload = {'created_at': row['key'][1], 'id': row['id']}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor. Raises InvalidCursor if the cursor is malformed
+
+    :param cursor: Cursor string sent by the client
+    :return: Tuple of the created_at and document id of the row the page starts at
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(payload['created_at']), str(payload['id'])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor()
+
+
+def get_order_history(database, user_uuid, limit, cursor=None):
+    """
+    Get a page of a user's orders, newest first, and the totals of all of them with one view request
+
+    :param database: The database
+    :param user_uuid: Unique identifier for the user
+    :param limit: Number of orders per page
+    :param cursor: Optional cursor of the page, as returned with the previous page
+    :return: Dictionary of the page's orders, the cursor of the next page, or None on the last page, and the totals
+    """
+    page = {
+        'reduce': False, 'descending': True, 'include_docs': True, 'limit': limit + 1,
+        'startkey': [user_uuid, {}], 'endkey': [user_uuid]
+    }
+    if cursor is not None:
+        created_at, order_id = decode_cursor(cursor)
+        page.update(startkey=[user_uuid, created_at], startkey_docid=order_id)
+    totals = {'reduce': True, 'startkey': [user_uuid], 'endkey': [user_uuid, {}]}
+    _, _, data = database.resource(*ORDER_HISTORY_VIEW, 'queries').post_json(body={'queries': [page, totals]})
+    page_result, totals_result = data['results']
+
+    rows = page_result['rows']
+    stats = totals_result['rows'][0]['value'] if totals_result['rows'] else {}
+    return {
+        'orders': [row['doc'] for row in rows[:limit]],
+        'next_cursor': encode_cursor(rows[limit]) if len(rows) > limit else None,
+        'totals': {
+            'count': stats.get('count', 0),
+            'total_spent': round(stats.get('sum', 0), 2),
+            'smallest_order': stats.get('min'),
+            'largest_order': stats.get('max')
+        }
+    }
@@ -0,0 +1,110 @@
+"""
+Password hashing off the request threads
+
+Password hashes are deliberately expensive. Computed on the request threads, a burst of logins takes all the CPU of a
+worker and every other endpoint waits behind it. PasswordHasher runs them in a small pool of processes instead, and
+bounds how many hashes may be queued or running. Past that bound new ones are refused at once with HashingBusy, which
+the app returns as 503, rather than queued behind work that is already late.
+
+The hash method and its cost are configurable. Stored hashes made with another method or cost are reported by
+needs_upgrade, so they can be replaced after a successful login.
+"""
+import concurrent.futures
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def hash_prefix(method):
+    """
+    Parse a werkzeug hash method the way werkzeug does, without hashing anything
+
+    :param method: werkzeug hash method, with or without its cost
+    :return: The method as werkzeug writes it at the start of its hashes, with the default cost filled in
+    """
+    if method == 'plain':
+        return method
+    if not method.startswith('pbkdf2:'):
+        hashlib.new(method)
+        return method
+    args = method[7:].split(':')
+    if len(args) not in (1, 2):
+        raise ValueError(f"Invalid password hash method {method}")
+    hashlib.new(args[0])
+    iterations = int(args[1] or 0) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+    return f'pbkdf2:{args[0]}:{iterations}'
+
+
+class PasswordHasher:
+    """
+    Process pool hashing and checking passwords
+
+    :param method: werkzeug hash method with its cost, e.g. pbkdf2:sha256:600000
+    :param workers: Number of hashing processes
+    :param max_pending: Maximum number of hashes queued or running, more are refused with HashingBusy
+    :param timeout: Seconds to wait for a hash before giving up with HashingBusy
+    """
+    def __init__(self, method, workers, max_pending, timeout):
+        self.method = method
+        # Parsed at startup, which also rejects an unknown method before the first login
+        self._prefix = hash_prefix(method)
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Started on first use. Workers are spawned rather than forked, so they do not inherit the server's threads
+        # and listening socket
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            with self._executor_lock:
+                self._executor = None
+            raise HashingBusy()
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except (concurrent.futures.TimeoutError, BrokenProcessPool):
+            raise HashingBusy()
+
+    def hash(self, password):
+        """
+        :param password: Password to be hashed
+        :return: The password's hash, made with the configured method
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, password_hash, password):
+        """
+        :param password_hash: Stored hash
+        :param password: Password to be checked
+        :return: True if the password matches the hash
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_upgrade(self, password_hash):
+        """
+        :param password_hash: Stored hash
+        :return: True if the hash was made with another method or cost than the configured one
+        """
+        return password_hash.split('$', 1)[0] != self._prefix
@@ -0,0 +1,255 @@
+"""
+Sales aggregates maintained from the CouchDB _changes feed
+
+A background thread follows the _changes feed of the orderservice database from a checkpointed sequence and folds
+orders and order lines into Redis, so reporting reads a handful of keys instead of scanning the database:
+
+- {sales}:orders:<day> and {sales}:paid:<day>, the sets of the day's orders and of those that are paid,
+- {sales}:day:<day>, a hash of the day's units and revenue,
+- {sales}:units:<day> and {sales}:revenue:<day>, hashes of units and revenue per item_uuid,
+- {sales}:top_units and {sales}:top_revenue, sorted sets of the units and revenue of every item,
+- {sales}:item_names, a hash of item_uuid to name.
+
+Each batch of changes is folded by one Lua script, which also moves the checkpoint, and only if the checkpoint is still
+where the batch was read from. A batch is therefore applied exactly once, even if two replicas read it. After a
+restart the consumer resumes from the checkpoint. Lines are recorded in {sales}:lines:<day> as they are counted, so a
+line is added once and only subtracted if it was added. Orders and lines are deleted with their body, so their
+tombstones say what to subtract. Updating an order moves it in or out of the paid set.
+
+The script is passed every key it touches, and all keys share the {sales} hash tag, so it also runs on a Redis
+Cluster, where they are all on one slot.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+
+import redis
+
+from database import couchdb_errors
+from redis_lock import RedisLock
+
+CHECKPOINT_KEY = '{sales}:checkpoint'
+LOCK_KEY = '{sales}:lock'
+TOP_UNITS_KEY = '{sales}:top_units'
+TOP_REVENUE_KEY = '{sales}:top_revenue'
+ITEM_NAMES_KEY = '{sales}:item_names'
+# Keys of one day, in the order they are passed to the fold script
+DAY_KEYS = ('orders', 'paid', 'lines', 'day', 'units', 'revenue')
+
+# KEYS: checkpoint, top units, top revenue, item names, then the DAY_KEYS of every day in the batch. ARGV: checkpoint
+# the batch was read from, checkpoint after the batch, JSON list of changes, each with the index in KEYS its day's keys
+# start after. Returns 0 without doing anything if the checkpoint has moved since the batch was read
+FOLD = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+    return 0
+end
+for _, change in ipairs(cjson.decode(ARGV[3])) do
+    local orders, paid, lines, day, units, revenue = unpack(KEYS, change['keys'] + 1, change['keys'] + 6)
+    if change['type'] == 'order' then
+        if change['deleted'] then
+            redis.call('SREM', orders, change['id'])
+            redis.call('SREM', paid, change['id'])
+        else
+            redis.call('SADD', orders, change['id'])
+            if change['is_paid'] then
+                redis.call('SADD', paid, change['id'])
+            else
+                redis.call('SREM', paid, change['id'])
+            end
+        end
+    else
+        local sign = 1
+        local counted
+        if change['deleted'] then
+            sign = -1
+            counted = redis.call('SREM', lines, change['id'])
+        else
+            counted = redis.call('SADD', lines, change['id'])
+        end
+        if counted == 1 then
+            local quantity = sign * change['quantity']
+            local line_total = tostring(sign * change['line_total'])
+            redis.call('HINCRBY', day, 'units', quantity)
+            redis.call('HINCRBYFLOAT', day, 'revenue', line_total)
+            redis.call('HINCRBY', units, change['item_uuid'], quantity)
+            redis.call('HINCRBYFLOAT', revenue, change['item_uuid'], line_total)
+            redis.call('ZINCRBY', KEYS[2], quantity, change['item_uuid'])
+            redis.call('ZINCRBY', KEYS[3], line_total, change['item_uuid'])
+            redis.call('HSET', KEYS[4], change['item_uuid'], change['item_name'])
+        end
+    end
+end
+redis.call('SET', KEYS[1], ARGV[2])
+return 1
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def day_key(name, day):
+    """
+    :param name: One of DAY_KEYS
+    :param day: ISO date of the day
+    :return: The day's key
+    """
+    return f'{{sales}}:{name}:{day}'
+
+
+def to_sales_change(row):
+    """
+    :param row: Row of the _changes feed, read with include_docs
+    :return: What the fold script needs of an order or order line, or None for other documents
+    """
+    doc = row.get('doc') or {}
+    if doc.get('type') not in ('order', 'order_line') or 'created_at' not in doc:
+        # Not an order, or deleted without its body
+        return None
+    change = {'type': doc['type'], 'id': doc['_id'], 'day': doc['created_at'][:10], 'deleted': bool(row.get('deleted'))}
+    if doc['type'] == 'order':
+        change['is_paid'] = bool(doc.get('is_paid'))
+    else:
+        change.update(item_uuid=doc['item_uuid'], item_name=doc.get('item_name', ''), quantity=doc['quantity'],
+                      line_total=doc['line_total'])
+    return change
+
+
+class SalesAggregator:
+    """
+    Folds the _changes feed into the sales aggregates
+
+    :param database: The orderservice database
+    :param redis_client: Redis client created with decode_responses=True
+    :param batch_size: Number of changes read and folded at once
+    :param lock_seconds: How long a replica may follow the feed before another one may take over
+    """
+    def __init__(self, database, redis_client, batch_size=500, lock_seconds=60):
+        self.database = database
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+        self.lock_seconds = lock_seconds
+        self.fold = redis_client.register_script(FOLD)
+
+    def fold_batch(self):
+        """
+        Fold the next batch of changes after the checkpoint
+
+        :return: Number of changes read, 0 once the feed is caught up
+        """
+        checkpoint = self.redis_client.get(CHECKPOINT_KEY) or ''
+        feed = self.database.changes(since=checkpoint or 0, limit=self.batch_size, include_docs=True)
+        rows = feed['results']
+        if not rows:
+            return 0
+        changes = [change for change in map(to_sales_change, rows) if change is not None]
+        keys = [CHECKPOINT_KEY, TOP_UNITS_KEY, TOP_REVENUE_KEY, ITEM_NAMES_KEY]
+        day_offsets = {}
+        for change in changes:
+            if change['day'] not in day_offsets:
+                day_offsets[change['day']] = len(keys)
+                keys.extend(day_key(name, change['day']) for name in DAY_KEYS)
+            change['keys'] = day_offsets[change['day']]
+        if not self.fold(keys=keys, args=[checkpoint, str(feed['last_seq']), json.dumps(changes)]):
+            logger.warning("Sales checkpoint moved while a batch was folded, reading it again")
+        return len(rows)
+
+    def catch_up(self):
+        """
+        Fold batches until the feed is caught up, unless another replica is following it
+        """
+        lock = RedisLock(self.redis_client, LOCK_KEY, self.lock_seconds)
+        if not lock.acquire():
+            return
+        try:
+            while self.fold_batch() == self.batch_size:
+                if not lock.extend():
+                    logger.warning("Lost the sales lock while catching up, leaving it to its new holder")
+                    return
+        finally:
+            lock.release()
+
+    def start(self, interval):
+        """
+        Follow the feed from a daemon thread
+
+        :param interval: Seconds between catch ups
+        """
+        def run():
+            while True:
+                try:
+                    self.catch_up()
+                except (redis.RedisError, *couchdb_errors):
+                    logger.exception("Could not fold the sales changes")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='sales-aggregator', daemon=True).start()
+
+    def stats(self, first_day, last_day, top):
+        """
+        Read the aggregates with one pipelined round trip, and one more for the revenue of the top sellers and the
+        names of the reported items
+
+        :param first_day: First day of the report
+        :param last_day: Last day of the report
+        :param top: Number of items in the top sellers and per day
+        :return: Dictionary of the sales of every day and the top sellers of all time
+        """
+        days = [first_day + datetime.timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for day in map(datetime.date.isoformat, days):
+            pipeline.scard(day_key('orders', day))
+            pipeline.scard(day_key('paid', day))
+            pipeline.hgetall(day_key('day', day))
+            pipeline.hgetall(day_key('units', day))
+            pipeline.hgetall(day_key('revenue', day))
+        # Items whose orders were all deleted are left with 0 units
+        pipeline.zrevrangebyscore(TOP_UNITS_KEY, '+inf', '(0', start=0, num=top, withscores=True)
+        pipeline.get(CHECKPOINT_KEY)
+        *per_day, top_units, checkpoint = pipeline.execute()
+
+        top_items = [item_uuid for item_uuid, _ in top_units]
+        day_items = []
+        for index in range(len(days)):
+            units, revenues = per_day[5 * index + 3:5 * index + 5]
+            day_items.append(sorted((item_uuid for item_uuid, count in units.items() if int(count) > 0),
+                                    key=lambda item_uuid: float(revenues.get(item_uuid, 0)), reverse=True)[:top])
+        # Only the names of the reported items, the hash holds every item ever sold
+        reported = list(dict.fromkeys(top_items + [item_uuid for items in day_items for item_uuid in items]))
+        top_revenue, names = {}, {}
+        if reported:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            if top_items:
+                pipeline.zmscore(TOP_REVENUE_KEY, top_items)
+            pipeline.hmget(ITEM_NAMES_KEY, reported)
+            *revenues, item_names = pipeline.execute()
+            if top_items:
+                top_revenue = dict(zip(top_items, revenues[0]))
+            names = dict(zip(reported, item_names))
+
+        report = []
+        for index, (day, items) in enumerate(zip(days, day_items)):
+            orders, paid, totals, units, revenues = per_day[5 * index:5 * index + 5]
+            report.append({
+                'day': day.isoformat(),
+                'orders': orders,
+                'paid_orders': paid,
+                'units': int(totals.get('units', 0)),
+                'revenue': round(float(totals.get('revenue', 0)), 2),
+                'items': [{
+                    'item_uuid': item_uuid,
+                    'item_name': names.get(item_uuid),
+                    'units': int(units[item_uuid]),
+                    'revenue': round(float(revenues.get(item_uuid, 0)), 2)
+                } for item_uuid in items]
+            })
+        return {
+            'days': report,
+            'top_sellers': [{
+                'item_uuid': item_uuid,
+                'item_name': names.get(item_uuid),
+                'units': int(units),
+                'revenue': round(float(top_revenue.get(item_uuid) or 0), 2)
+            } for item_uuid, units in top_units],
+            'checkpoint': checkpoint
+        }
@@ -0,0 +1,115 @@
+"""
+Cache of the users behind authentication tokens
+
+verify_token runs on every authenticated request. Without a cache each of them queries the user_by_uuid view just to
+find out who the caller is. The cache keeps the user documents by user_uuid in an in-process LRU. An optional Redis
+second tier is shared by all replicas.
+
+An entry never outlives the token it was looked up for. It expires after the cache TTL or at the token's exp,
+whichever comes first. update_user and delete_user invalidate both tiers. Other replicas' first tiers are not notified,
+so a changed or deleted user may still be served by them for up to the first-tier TTL. That TTL should stay short.
+Password hashes are never cached, neither in process nor in Redis.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+# Fields of the user documents that are not cached. verify_token does not need the password hash, and the revision
+# is read fresh by the endpoints that change a user
+UNCACHED_FIELDS = ('password', '_rev')
+
+
+class UserCache:
+    """
+    LRU + TTL cache of user documents keyed by user_uuid
+
+    :param max_size: Maximum number of users kept in process
+    :param ttl: Seconds a user is kept in process
+    :param redis_client: Optional Redis client used as the shared second tier
+    :param redis_ttl: Seconds a user is kept in Redis
+    """
+    def __init__(self, max_size=10000, ttl=30, redis_client=None, redis_ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _redis_key(user_uuid):
+        return f'user_session:{user_uuid}'
+
+    def _set_local(self, user_uuid, user, seconds):
+        self._users[user_uuid] = (time.monotonic() + seconds, user)
+        self._users.move_to_end(user_uuid)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def get(self, user_uuid):
+        """
+        Look up a user, first in process and then in Redis
+
+        :param user_uuid: Unique identifier for the user
+        :return: The user document, or None if it is not cached
+        """
+        with self._lock:
+            entry = self._users.get(user_uuid)
+            if entry is not None:
+                expires_at, user = entry
+                if expires_at >= time.monotonic():
+                    self._users.move_to_end(user_uuid)
+                    return user
+                del self._users[user_uuid]
+        if self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                pipeline.get(self._redis_key(user_uuid))
+                pipeline.pttl(self._redis_key(user_uuid))
+                raw, pttl = pipeline.execute()
+            except redis.RedisError:
+                raw = None
+            if raw is not None and pttl > 0:
+                user = json.loads(raw)
+                with self._lock:
+                    self._set_local(user_uuid, user, min(self.ttl, pttl / 1000))
+                return user
+        return None
+
+    def set(self, user_uuid, user, token_exp):
+        """
+        Store a user in both tiers until the cache TTL or the token expiry, whichever comes first
+
+        :param user_uuid: Unique identifier for the user
+        :param user: The user document, as read from CouchDB. Its UNCACHED_FIELDS are left out
+        :param token_exp: exp claim of the token the user was looked up for, in seconds since the epoch
+        """
+        token_seconds = token_exp - time.time()
+        if token_seconds <= 0:
+            return
+        user = {field: value for field, value in user.items() if field not in UNCACHED_FIELDS}
+        with self._lock:
+            self._set_local(user_uuid, user, min(self.ttl, token_seconds))
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(self._redis_key(user_uuid), json.dumps(user),
+                                      px=int(min(self.redis_ttl, token_seconds) * 1000) or 1)
+            except redis.RedisError:
+                pass
+
+    def invalidate(self, user_uuid):
+        """
+        Drop a user from both tiers
+
+        :param user_uuid: Unique identifier for the user that changed
+        """
+        with self._lock:
+            self._users.pop(user_uuid, None)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(self._redis_key(user_uuid))
+            except redis.RedisError:
+                pass